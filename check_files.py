@@ -23,6 +23,8 @@ Notes:
 History:
 
 111107 ksl Coding begun
+261018	   Read the summary file with per_sum
+261018	   Check the files to which compact persistence files refer
 
 '''
 
@@ -30,6 +32,7 @@ import sys
 import os
 import per_list
 import per_fits
+import per_sum
 
 def read_summary_file(fileroot='observations'):
 	'''
@@ -37,19 +40,11 @@ def read_summary_file(fileroot='observations'):
 
 	This routine assumes there are no comment
 	lines in the summary file
-	'''
-
-	summary_file=fileroot+'.sum'
 
-	f=open(summary_file,'r')
-	summary=f.readlines()
-	f.close()
+	261018		Use per_sum, which does skip any comment lines
+	'''
 
-	records=[]
-	for record in summary:
-		record=record.split()
-		records.append(record)
-	return(records)
+	return per_sum.get_summary(fileroot).select('All')
 
 
 
@@ -62,6 +57,8 @@ def doit(fileroot='observations'):
 
 	Note: It is possible this should be included 
 	as part of per_list
+
+	261018		Check that compact persistence files refer to a file which exists
 	'''
 	records=per_list.read_ordered_list0(fileroot)
 	sums=read_summary_file(fileroot)
@@ -95,8 +92,13 @@ def doit(fileroot='observations'):
 		persist='yes'
 		if persist_name!='None' and os.path.exists(persist_name)==False:
 			persist='no'
+		elif persist_name!='None':
+			# A compact persistence file is incomplete without the file it refers to 
+			source=per_fits.get_product_source(persist_name)
+			if source!='' and os.path.exists(source)==False:
+				persist='no source'
 
-		if persist=='no' or flt=='no':
+		if persist!='yes' or flt=='no':
 			string= '%10s %50s %10s  %60s %10s' % (record[1],flt_name,flt,persist_name,persist)
 			print string
 			g.write('%s\n' % string)
@@ -11,41 +11,314 @@ will be returned.  If it is in one of the subdirectories of the
 current directory then the one that was modified most recently
 will be returned. 
 
+The module also contains the routines used to walk through the 
+directory structure, which are used by per_list to find all of the
+files of a certain type, and which maintain an index of all of the
+files that were seen, so that later searches do not have to walk 
+the directory structure again.
+
 
 Command line usage (if any):
 
 		usage: find.py  filename'
+		       find.py  -index  (to rebuild the index)
 
 Description:  
 
 Primary routines:
 
+	find_best	Locate the best version of a file
+	walk_files	Generate the paths of all the files which match a pattern
+	make_index	Rebuild the index of all the files
+
 Notes:
 									   
 History:
 
 100906 ksl Coding begun
+261018	Replaced the use of the unix utility find with walk_files, and added
+	the index
 
 '''
 
 import os
 import sys
-import subprocess
+import fnmatch
+import threading
+import Queue
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		scandir=None
+
+
+# The name of the file containing the index of all of the files in the directory structure
+INDEX='find.idx'
+
+# The index which has been read, and the modification time of the file it was read from
+index_dirs={}
+index_mtime=0
+
+
+def list_dir(path):
+	'''
+	Return lists of the subdirectories and of the files in
+	a directory.  Symbolic links are followed, as with find -follow.
+	If the directory can not be read, two empty lists are returned.
+
+	History:
+
+	261018	Coded
+	'''
+
+	dirs=[]
+	files=[]
+	try:
+		if scandir!=None:
+			for entry in scandir(path):
+				try:
+					isdir=entry.is_dir()
+				except OSError:
+					isdir=False
+				if isdir:
+					dirs.append(entry.name)
+				else:
+					files.append(entry.name)
+		else:
+			for name in os.listdir(path):
+				if os.path.isdir(os.path.join(path,name)):
+					dirs.append(name)
+				else:
+					files.append(name)
+	except OSError:
+		return [],[]
+	return dirs,files
+
+def walk_tree(top,pattern,visited,lock,index):
+	'''
+	Generate the paths of the files below the directory top whose names match 
+	pattern.  
+
+	visited is a dictionary of the directories (identified by device and
+	inode) which have been seen, so that loops caused by symbolic links
+	are only followed once, and lock is a lock which protects it, since
+	several trees may be walked at once.
+
+	If index is a dictionary, the names of all the files in each directory
+	are added to it.
+
+	History:
+
+	261018	Coded
+	'''
+
+	stack=[top]
+	while len(stack)>0:
+		path=stack.pop()
+		try:
+			stat=os.stat(path)
+		except OSError:
+			continue
+		key=(stat.st_dev,stat.st_ino)
+		lock.acquire()
+		seen=key in visited
+		visited[key]=True
+		lock.release()
+		if seen:
+			continue
+
+		dirs,files=list_dir(path)
+		if index!=None:
+			index[path]=files
+		for name in files:
+			if fnmatch.fnmatchcase(name,pattern):
+				yield os.path.join(path,name)
+		dirs.sort(reverse=True)
+		for name in dirs:
+			stack.append(os.path.join(path,name))
+
+def walk_files(top='.',pattern='*',threads=1,index=None):
+	'''
+	Generate the paths of all of the files in the directory top and
+	its subdirectories whose names match pattern, in the same form as
+	they would be given by 
+
+	find top -follow -name pattern
+
+	The paths are generated as the directories are read, so that the
+	caller can start work on them immediately.
+
+	If threads is greater than 1, the directories immediately below top 
+	are walked at the same time, by up to that many threads, which helps 
+	if the files are on a network file system.
+
+	If index is a dictionary, the names of all the files in each directory
+	are added to it (see write_index).
+
+	History:
+
+	261018	Coded to replace the use of find
+	'''
+
+	visited={}
+	lock=threading.Lock()
+
+	if threads<=1:
+		for path in walk_tree(top,pattern,visited,lock,index):
+			yield path
+		return
 
+	# Handle top itself in this thread, and give each of the subdirectories to the pool of threads
+	try:
+		stat=os.stat(top)
+	except OSError:
+		return
+	visited[(stat.st_dev,stat.st_ino)]=True
 
+	dirs,files=list_dir(top)
+	if index!=None:
+		index[top]=files
+	for name in files:
+		if fnmatch.fnmatchcase(name,pattern):
+			yield os.path.join(top,name)
 
-def find_best(filename='foo'):
+	tasks=Queue.Queue()
+	for name in dirs:
+		tasks.put(os.path.join(top,name))
+
+	results=Queue.Queue(10000)
+	nthreads=min(threads,len(dirs))
+
+	def worker():
+		while True:
+			try:
+				path=tasks.get_nowait()
+			except Queue.Empty:
+				break
+			for one in walk_tree(path,pattern,visited,lock,index):
+				results.put(one)
+		results.put(None)
+
+	i=0
+	while i<nthreads:
+		thread=threading.Thread(target=worker)
+		thread.daemon=True
+		thread.start()
+		i=i+1
+
+	ndone=0
+	while ndone<nthreads:
+		path=results.get()
+		if path==None:
+			ndone=ndone+1
+		else:
+			yield path
+
+def write_index(index,filename=INDEX):
+	'''
+	Write the index of the files in each directory, as created by walk_files.
+	Each line of the file contains the name of a directory followed by the
+	names of the files in it, separated by tabs.
+
+	History:
+
+	261018	Coded
+	'''
+
+	tmpfile='%s.%d.tmp' % (filename,os.getpid())
+	f=open(tmpfile,'w')
+	for path in sorted(index.keys()):
+		f.write('%s\t%s\n' % (path,'\t'.join(index[path])))
+	f.close()
+	os.chmod(tmpfile,0770)
+	os.rename(tmpfile,filename)
+	return
+
+def read_index(filename=INDEX):
+	'''
+	Read the index written by write_index, and return a dictionary
+	which gives, for each file name, the directories which contain a
+	file of that name.  The index is only read again if it has changed.
+	If there is no index, an empty dictionary is returned.
+
+	History:
+
+	261018	Coded
+	'''
+	global index_dirs
+	global index_mtime
+
+	try:
+		mtime=os.path.getmtime(filename)
+	except OSError:
+		return {}
+
+	if mtime==index_mtime:
+		return index_dirs
+
+	index_dirs={}
+	f=open(filename,'r')
+	for line in f:
+		words=line.rstrip('\n').split('\t')
+		for name in words[1:]:
+			index_dirs.setdefault(name,[]).append(words[0])
+	f.close()
+	index_mtime=mtime
+	return index_dirs
+
+def make_index(top='.',filename=INDEX,threads=1):
+	'''
+	Walk the entire directory structure and rewrite the index
+
+	History:
+
+	261018	Coded
+	'''
+
+	index={}
+	for path in walk_files(top,'',threads,index):
+		pass
+	write_index(index,filename)
+	return
+
+def find_best(filename='foo',use_index='yes'):
 	'''
 	Find the best version of a file, defined to be the one in
 	the current directory or the most recent one in any of the 
 	subdirectories.
 
 	This returns and empty string if nothing is found
+
+	Notes:
+
+	If use_index is 'yes' and the file is in the index written by
+	walk_files (normally when per_list makes a new .ls file), only
+	the directories listed there are checked.  Otherwise the 
+	directory structure is walked.  A version of a file which was
+	created elsewhere after the index was written will only be found 
+	if no version that is in the index still exists.
+
+	History:
+
+	261018	Replaced find with the index and walk_files
 	'''
 
-	proc=subprocess.Popen('find . -follow -name %s -print ' % filename,shell=True,stdout=subprocess.PIPE)
-	# Before
-	lines=proc.stdout.readlines()
+	lines=[]
+	if os.path.isfile(filename):
+		lines=[os.path.join('.',filename)]
+	elif use_index=='yes':
+		for path in read_index().get(filename,[]):
+			xfile=os.path.join(path,filename)
+			if os.path.isfile(xfile):
+				lines.append(xfile)
+
+	if len(lines)==0:
+		lines=list(walk_files('.',filename))
+
 	if len(lines)==0:
 			print 'Warning: find_best: No versions of %s found' % filename
 			return ''
@@ -69,10 +342,11 @@ def find_best(filename='foo'):
 # Next lines permit one to run the routine from the command line
 if __name__ == "__main__":
 	import sys
-	if len(sys.argv)>1:
+	if len(sys.argv)>1 and sys.argv[1]=='-index':
+		make_index()
+	elif len(sys.argv)>1:
 		# doit(int(sys.argv[1]))
 		x=find_best(sys.argv[1])
 		print x
 	else:
 		print 'usage: find.py  filename'
-
@@ -36,6 +36,7 @@ History:
 
 111117	ksl	Adapted from subtract_sum
 		on average
+261018		read_sum_file moved to per_sum
 
 '''
 
@@ -46,6 +47,7 @@ import numpy
 import subprocess
 import time
 import date
+import per_sum
 
 def read_sum_file(fileroot='observations',status='Complete',prog_id=0,mjd_start=0,mjd_stop=0,proc_start=0,proc_stop=0):
 	'''
@@ -64,87 +66,14 @@ def read_sum_file(fileroot='observations',status='Complete',prog_id=0,mjd_start=
 			NOTE -- It is not obvious that one should check for status at all, since one usually wants
 			to see what happened to a serios of files. What is more relevebant is the program ID or
 			whether one attempted to process it in a certain period.
+	261018		The work is now done by per_sum.read_sum_file, which is shared with subtract_sum.
+			As a result the 130103 fix in subtract_sum, which uses mjd_start when mjd_stop is
+			not given, now applies here too.
 
 
 	'''
 
-	filename=fileroot+'.sum'
-
-	try:
-		f=open(filename,'r')
-		xlines=f.readlines()
-		f.close()
-	except IOError :
-		print "The file %s does not exist" % filename
-		return []   
-	
-	lines=[]
-
-	# print 'OK0',len(xlines)
-	
-	i=0
-	while i<len(xlines):
-		z=xlines[i].strip()
-		z=z.split()
-		if len(z)>0:
-			if z[0][0]!='#':
-				# print z[5].count(status),z
-				if z[5].count(status) or status=='All':
-					lines.append(z)
-		i=i+1
-	
-	# print 'OK1',len(lines)
-	
-	# At this point we have split the records into words and we have chosen according to status
-
-	if prog_id != 0:
-		xlines=lines
-		lines=[]
-		for z in xlines:
-			if int(z[1])==int(prog_id):
-				lines.append(z)
-	# At this point our list has been reduced to those of the status we want and the prog_id we want
-
-	# print 'OK2',len(lines)
-
-	if mjd_stop > 0 and mjd_start <  mjd_stop:
-		xlines=lines
-		lines=[]
-		for z in xlines:
-			xtime=eval(z[2])
-			if mjd_start <= xtime and xtime <= mjd_stop:
-				lines.append(z)
-
-	# Convert proc start and stop time to MJD
-	# print 'OK3',len(lines)
-
-	if proc_start!=0:
-		try:
-			proc_start=float(proc_start)
-		except ValueError:
-			proc_start=date.parse_iso(proc_start)
-
-	if proc_stop!=0:
-		try:
-			proc_stop =float(proc_stop )
-		except ValueError:
-			proc_stop =date.parse_iso(proc_stop )
-
-	if proc_stop != 0 or proc_start <  proc_stop:
-		xlines=lines
-		lines=[]
-		for z in xlines:
-			# print z
-			# Construct the process time
-			proc_time='%s %s' % (z[3],z[4])
-			# print 'Starting',proc_time
-			proc_time=date.parse_iso(proc_time)  # Convert to Mjd
-			# print proc_time, 'xxx',proc_start,proc_stop
-			if proc_start <= proc_time and proc_time<=proc_stop:
-				lines.append(z)
-	# print 'OK4',len(lines)
-
-	return lines
+	return per_sum.read_sum_file(fileroot,status,prog_id,mjd_start,mjd_stop,proc_start,proc_stop)
 
 def doit(fileroot='observations',status='Complete',prog_id=0,mjd_start=0,mjd_stop=0,proc_start=0,proc_stop=0,censor='yes'):
 	'''
@@ -260,6 +260,8 @@ def doit(filename='foo.fits',mask_file='none',box=3,maxno=25,history_file='histo
 	130913  ksl     Restored the use of DQ flags to since the problem with loss of 
 			lock, which in certain cases, particularly darks, caused all
 			pixels to have bad DQ.
+	261018		Read the image and the DQ of the mask file together with read_exposure
+	261018		Locate the SCI extension of the persistence file by name
 
 
 	'''
@@ -287,8 +289,12 @@ def doit(filename='foo.fits',mask_file='none',box=3,maxno=25,history_file='histo
 		outroot=filename
 		print 'File had no extensions, using entire name'
 
-	# Read the persistence file
-	x=per_fits.get_image(filename,1)
+	# Read the persistence file, which may have been written in the compact form, so 
+	# the SCI extension is located by name
+	x=[]
+	ext=per_fits.get_ext_number(filename,'SCI')
+	if ext>0:
+		x=per_fits.get_image(filename,ext)
 	if len(x)==0:
 		print 'Error: peaks:  Nothing to do since no data returned for %s' % filename
 		history.write('Peaks: Nothing to do since no data returned for %s\n' % filename)
@@ -304,9 +310,14 @@ def doit(filename='foo.fits',mask_file='none',box=3,maxno=25,history_file='histo
 	# Then smooth the persitence image  so that peak finding is easier
 
 	if mask_file!='none':
-		mask=per_fits.get_image(mask_file,1,rescale='e/s')
+		exposure=per_fits.read_exposure(mask_file,rescale='e/s')
+		if exposure==None:
+			print 'Error: peaks:  Nothing to do since no data returned for %s' % mask_file
+			history.write('Peaks: Nothing to do since no data returned for %s\n' % mask_file)
+			return 'NOK'
+		mask=exposure.sci
 		xmask=smooth(mask,box)
-		dq=per_fits.get_image(mask_file,3,rescale='no')
+		dq=exposure.dq
 		z=numpy.select([dq>0],[0],default=x)
 		z=smooth(z,box)
 		history.write('Peaks: Using %s to mask exposure\n' % mask_file)
@@ -27,11 +27,20 @@ History:
 	   to get keywords form files
 130909 ksl Standardized printed error messages
 140310 ksl Switched to astropy for fits IO
+261018	   Added FitsSession, so that files are only opened once
+	   while a dataset is processed
+261018	   Added map_image, so that sections of images can be read without
+	   reading the entire image
+261018	   Added read_exposure, which reads the science and data quality
+	   images of an exposure together
+261018	   Added ProductWriter, which writes several copies of a file with
+	   one extension replaced, optionally in a compact form
 
 '''
 
 import sys
 import os
+import threading
 
 # import pyraf
 from astropy.io import fits as pyfits
@@ -41,6 +50,146 @@ import string
 import permissions
 
 
+# This is the section which allows a set of files to be opened only once while a dataset is 
+# processed.  Between begin_session and end_session, the routines below which read fits files 
+# obtain them from a FitsSession, rather than opening them each time.
+
+class FitsSession(object):
+	'''
+	The fits files which have been opened during a session, so that
+	each is only opened (and each header and each extension is only
+	read) once.
+
+	hdulists	a dictionary containing the astropy HDUList for each
+			file that has been opened, indexed by the name of the file
+
+	Notes:
+
+	astropy reads the header and the data of an extension the first time
+	they are needed, and keeps them, so holding the HDUList is enough
+	to keep the headers and the arrays which have been read.  
+
+	The arrays belong to the session, so routines which return them to
+	their callers must return copies.
+
+	Files which are only needed once, or which are about to be modified, 
+	should be removed from the session with evict.
+
+	History:
+
+	261018	Coded
+	'''
+
+	def __init__(self):
+		self.hdulists={}
+
+	def open(self,filename):
+		'''
+		Return the HDUList for a file, opening it if it has not been opened
+		already.  As for astropy.io.fits.open, IOError is raised if the file
+		cannot be opened.
+		'''
+
+		z=self.hdulists.get(filename)
+		if z==None:
+			z=pyfits.open(filename)
+			self.hdulists[filename]=z
+		return z
+
+	def evict(self,filename):
+		'''
+		Close a file and remove it from the session
+		'''
+
+		z=self.hdulists.pop(filename,None)
+		if z!=None:
+			z.close()
+		return
+
+	def close(self):
+		'''
+		Close all of the files in the session
+		'''
+
+		for filename in self.hdulists.keys():
+			self.evict(filename)
+		return
+
+fits_session=None
+
+def begin_session():
+	'''
+	Begin a new session, closing any session which is already open, and
+	return it
+
+	History:
+
+	261018	Coded
+	'''
+	global fits_session
+
+	end_session()
+	fits_session=FitsSession()
+	return fits_session
+
+def end_session():
+	'''
+	Close all of the files in the current session, and end it
+
+	History:
+
+	261018	Coded
+	'''
+	global fits_session
+
+	if fits_session!=None:
+		fits_session.close()
+		fits_session=None
+	return
+
+def evict(filename):
+	'''
+	Close a file if it is part of the current session, so that it will be
+	opened again the next time it is needed.  filename may include an 
+	extension.
+
+	History:
+
+	261018	Coded
+	'''
+
+	if fits_session!=None:
+		fits_session.evict(parse_fitsname(filename)[0])
+	return
+
+def open_fits(filename):
+	'''
+	Open a fits file, from the current session if there is one.
+	Files opened with this routine should be closed with close_fits.
+
+	History:
+
+	261018	Coded
+	'''
+
+	if fits_session!=None:
+		return fits_session.open(filename)
+	return pyfits.open(filename)
+
+def close_fits(z):
+	'''
+	Close a file opened with open_fits, unless it belongs to the current
+	session
+
+	History:
+
+	261018	Coded
+	'''
+
+	if fits_session==None:
+		z.close()
+	return
+
 
 def parse_fitsname(name,ext=1,force_ext='no'):
 	'''
@@ -94,11 +243,70 @@ def parse_fitsname(name,ext=1,force_ext='no'):
 	return xname,xext,'%s[%d]' % (xname,xext)
 
 
+def get_ext_number(filename,extname='SCI'):
+	'''
+	Return the number of the first extension of a file with EXTNAME extname, 
+	or -1 if there is no such extension.  This allows files which have been 
+	written in the compact form by ProductWriter to be read in the same
+	way as full files.
+
+	History
+
+	261018	Coded
+	'''
+
+	try:
+		z=open_fits(parse_fitsname(filename)[0])
+	except IOError:
+		print 'Error: get_ext_number: file %s not found' % filename
+		return -1
+
+	number=-1
+	i=1
+	while i<len(z):
+		if z[i].header.get('EXTNAME','').strip().upper()==extname.upper():
+			number=i
+			break
+		i=i+1
+
+	if number<0:
+		print 'Error: get_ext_number: there is no %s extension in file %s' % (extname,filename)
+
+	close_fits(z)
+	return number
+
+
+def get_product_source(filename):
+	'''
+	Return the name of the file from which a file written in the compact
+	form by ProductWriter was made, or '' if the file is not compact (or
+	cannot be read)
+
+	History
+
+	261018	Coded
+	'''
+
+	try:
+		z=open_fits(parse_fitsname(filename)[0])
+	except IOError:
+		print 'Error: get_product_source: file %s not found' % filename
+		return ''
+
+	source=z[0].header.get('SRCFLT','')
+	close_fits(z)
+
+	if source=='':
+		return ''
+	return os.path.normpath(os.path.join(os.path.dirname(parse_fitsname(filename)[0]),source))
+
+
 def get_ext_type(filename,exten=1):
 	'''
 	Open and image and find out what type it is
 
 	101203	Modified so filename is parsed in standard fashion
+	261018	Use open_fits
 	'''
 
 	type='UNKNOWN'
@@ -106,7 +314,7 @@ def get_ext_type(filename,exten=1):
 	name=parse_fitsname(filename,exten)
 
 	try:
-		z=pyfits.open(name[0])
+		z=open_fits(name[0])
 	except IOError:
 		print 'Error: get_ext_type: file %s not found' % filename
 		return 'UNKNOWN'
@@ -119,7 +327,7 @@ def get_ext_type(filename,exten=1):
 	except KeyError:
 		print 'Error: get_ext_type: EXTNAME is not found in header extension %d in file %s' % (exten,filename)
 
-	z.close()
+	close_fits(z)
 	return type
 
 
@@ -140,38 +348,124 @@ def get_image_pixel_info(filename,exten=1):
 	
 	[rows,cols,offset_y,offset_x]
 
-	from the image
+	from the image, or 'UNKNOWN' if the information could not be
+	obtained
 
 	History
 
 	101203	Modified so filename is parsed in standard fashion
+	261018	Use open_fits
+	261018	The information now comes from get_image_geometry, which only 
+		reads the header
 
 	'''
 
+	geometry=get_image_geometry(filename,exten)
+	if len(geometry)==0:
+		return 'UNKNOWN'
+	return geometry[0:4]
+
+
+def get_image_geometry(filename,exten=1):
+	'''
+	Get the size of an image and its position on the detector, along
+	with the units and exposure time, from the header, without reading
+	the image itself.
+
+	The routine returns
+
+	[rows,cols,offset_y,offset_x,bunit,exptime,dtype]
+
+	where the first four are as in get_image_pixel_info, bunit and 
+	exptime are 'Unknown' if they are not in the extension header
+	or the primary header, and dtype is the numpy dtype of the 
+	array which astropy would return for the image (see data_dtype).
+	An empty list is returned if the file, the extension, or the
+	size or position of the image, cannot be found.
+
+	History
+
+	261018	Coded, from get_image_pixel_info, which read the data to find its
+		size
+	'''
+
 	name=parse_fitsname(filename,exten)
 
 	try:
-		z=pyfits.open(name[0])
+		z=open_fits(name[0])
 	except IOError:
-		print 'Error: get_pixel_info: file %s not found' % filename
-		return 'UNKNOWN'
+		print 'Error: get_image_geometry: file %s not found' % filename
+		return []
 
+	geometry=[]
 	try:
-		one_ext=z[name[1]]
-		offset_x=one_ext.header['LTV1']
-		offset_y=one_ext.header['LTV2']
-		data=one_ext.data
-		shape=numpy.shape(data)
-		rows=shape[0]
-		cols=shape[1]
-
+		header=z[name[1]].header
+		if header['NAXIS']!=2:
+			print 'Error: get_image_geometry: extension %d of file %s is not an image' % (name[1],filename)
+		else:
+			geometry=header_geometry(header,z[0].header)
 	except IndexError:
-		print 'Error: get_image_pixel_info: %d exceeds the number of extensions in file %s' % (exten,filename)
-	except KeyError:
-		print 'Error: get_image_pixel_info: EXTNAME is not found in header extension %d in file %s' % (exten,filename)
+		print 'Error: get_image_geometry: %d exceeds the number of extensions in file %s' % (exten,filename)
+	except KeyError,e:
+		print 'Error: get_image_geometry: %s is not found in header extension %d in file %s' % (e,exten,filename)
+		geometry=[]
+
+	close_fits(z)
+	return geometry
 
-	z.close()
-	return [rows,cols,offset_y,offset_x]
+
+def header_geometry(header,primary):
+	'''
+	Return the geometry, as described in get_image_geometry, of an
+	image from its (astropy) header and the primary header of the
+	file.  KeyError is raised if the size or the position of the image
+	is not in the header.
+
+	History
+
+	261018	Split out of get_image_geometry
+	'''
+
+	geometry=[header['NAXIS2'],header['NAXIS1'],header['LTV2'],header['LTV1']]
+	for word in ['BUNIT','EXPTIME']:
+		if word in header:
+			geometry.append(header[word])
+		elif word in primary:
+			geometry.append(primary[word])
+		else:
+			geometry.append('Unknown')
+	geometry.append(data_dtype(header))
+	return geometry
+
+
+def data_dtype(header):
+	'''
+	Return the numpy dtype of the array that astropy returns for 
+	the data of an extension with this (astropy) header, taking
+	account of the scaling given by BZERO and BSCALE.
+
+	History
+
+	261018	Coded
+	'''
+
+	bitpix=header['BITPIX']
+	bzero=header.get('BZERO',0)
+	bscale=header.get('BSCALE',1)
+
+	if bitpix<0:
+		return numpy.dtype('>f%d' % (-bitpix//8))
+
+	if bscale==1 and bzero==0:
+		return numpy.dtype({8:'uint8',16:'>i2',32:'>i4',64:'>i8'}[bitpix])
+
+	# These are the conventions for unsigned (or for 8 bits, signed) integers 
+	if bscale==1 and (bitpix,bzero) in [(8,-128),(16,2**15),(32,2**31),(64,2**63)]:
+		return numpy.dtype({8:'int8',16:'uint16',32:'uint32',64:'uint64'}[bitpix])
+
+	if bitpix>16:
+		return numpy.dtype('float64')
+	return numpy.dtype('float32')
 
 
 def get_keyword(filename,exten,keywords='bunit',default='Unknown'):
@@ -203,6 +497,7 @@ def get_keyword(filename,exten,keywords='bunit',default='Unknown'):
 	one needs to explicitly carry out this procedure in pyfits
 
 	121220 ksl Added
+	261018	   Use open_fits
 	'''
 
 	# Next line means that you must always provide the exentsion
@@ -211,7 +506,7 @@ def get_keyword(filename,exten,keywords='bunit',default='Unknown'):
 	answer=default
 
 	try:
-		z=pyfits.open(name[0])
+		z=open_fits(name[0])
 	except IOError:
 		print 'Error: get_keyword: file %s not found' % filename
 		return default
@@ -221,6 +516,7 @@ def get_keyword(filename,exten,keywords='bunit',default='Unknown'):
 		one_ext=z[name[1]]
 	except IndexError:
 		print 'Error: get_keyword: %d exceeds the number of extensions in file %s' % (exten,filename)
+		close_fits(z)
 		return default
 
 
@@ -240,13 +536,176 @@ def get_keyword(filename,exten,keywords='bunit',default='Unknown'):
 				print 'Error: get_keyword: %s is not found in header extension %d in file %s' % (word,exten,filename)
 				answer.append(default)
 
-	z.close()
+	close_fits(z)
 
 
 	return answer
 
 
 
+def read_headers(filename,exten=1):
+	'''
+	Read the headers of the primary HDU and of the extensions up to and 
+	including exten of a fits file, without reading any of the data.
+
+	The routine returns a list containing a dictionary for each header, 
+	in which the values are the strings as they appear in the header 
+	(see parse_card), or an empty list if the file could not be read or 
+	does not have the extension.
+
+	Notes:
+
+	This reads the file directly in 2880 byte blocks, and skips over the
+	data, which makes it much faster than opening the file with astropy
+	(or pyraf) when only a few keywords are needed.  Only the first occurrence 
+	of a keyword in a header is kept.
+
+	History
+
+	261018	Coded to replace iraf.hselect in per_list
+	'''
+
+	headers=[]
+	try:
+		f=open(filename,'rb')
+	except IOError:
+		return []
+
+	try:
+		while len(headers)<=exten:
+			header={}
+			end=False
+			while end==False:
+				block=f.read(2880)
+				if len(block)<2880:
+					f.close()
+					return []
+				i=0
+				while i<2880:
+					card=block[i:i+80]
+					i=i+80
+					keyword=card[0:8].strip()
+					if keyword=='END':
+						end=True
+						break
+					if card[8:10]=='= ' and keyword not in header:
+						header[keyword]=parse_card(card[10:])
+			headers.append(header)
+
+			# Skip the data
+			if len(headers)<=exten:
+				nbytes=data_size(header)
+				f.seek(((nbytes+2879)//2880)*2880,1)
+	except ValueError:
+		f.close()
+		return []
+
+	f.close()
+	return headers
+
+def parse_card(value):
+	'''
+	Return the value portion of a header card as a string.  Strings are
+	returned without the quotes or trailing blanks, and other values without 
+	the comment.  Fortran-style D exponents are changed to E so that 
+	numbers can be converted with float.
+
+	History
+
+	261018	Coded
+	'''
+
+	value=value.strip()
+	if value[0:1]=="'":
+		i=1
+		xvalue=''
+		while i<len(value):
+			if value[i]=="'":
+				if value[i+1:i+2]=="'":
+					xvalue=xvalue+"'"
+					i=i+2
+					continue
+				break
+			xvalue=xvalue+value[i]
+			i=i+1
+		return xvalue.rstrip()
+
+	value=value.split('/')[0].strip()
+	if len(value)>0 and value[0] in '+-.0123456789':
+		value=value.replace('D','E').replace('d','e')
+	return value
+
+def data_size(header):
+	'''
+	Return the number of bytes of data (before padding) which follow 
+	a header read by read_headers
+
+	History
+
+	261018	Coded
+	'''
+
+	naxis=int(header.get('NAXIS','0'))
+	if naxis==0:
+		return 0
+
+	n=1
+	i=1
+	while i<=naxis:
+		n=n*int(header['NAXIS%d' % i])
+		i=i+1
+
+	bitpix=abs(int(header['BITPIX']))
+	pcount=int(header.get('PCOUNT','0'))
+	gcount=int(header.get('GCOUNT','1'))
+
+	return bitpix//8*gcount*(pcount+n)
+
+def get_header_keywords(filename,exten,keywords='bunit',default='INDEF'):
+	'''
+	Get one or more keywords from a fits file and extension as strings,
+	in the way that iraf.hselect does.  The routine looks first in
+	the extension, and then in the primary header.  
+
+	keywords is a string which contains the keywords, separated 
+	by commas or spaces.  
+
+	The routine returns a list of strings, with default in place of
+	any keyword that is not found, or an empty list if the file or 
+	extension could not be read
+
+	Notes:
+
+	Unlike get_keyword, this does not use astropy, see read_headers.
+
+	History
+
+	261018	Coded
+	'''
+
+	name=parse_fitsname(filename,exten,'yes')
+
+	headers=read_headers(name[0],name[1])
+	if len(headers)==0:
+		return []
+
+	keywords=keywords.replace(',',' ')
+	words=keywords.split()
+
+	answer=[]
+	for word in words:
+		word=word.upper()
+		if word in headers[name[1]]:
+			answer.append(headers[name[1]][word])
+		elif word in headers[0]:
+			answer.append(headers[0][word])
+		else:
+			answer.append(default)
+
+	return answer
+
+
+
 def put_keyword(filename,exten,keyword='bunit',value='electrons'):
 	'''
 	Put or update a keyword in a file.  If the keyword does not exist
@@ -265,11 +724,13 @@ def put_keyword(filename,exten,keyword='bunit',value='electrons'):
 
 
 	140605 ksl Added
+	261018	   The file is removed from the current session, since it is changed
 	'''
 
 	# Next line means that you must always provide the exentsion
 	name=parse_fitsname(filename,exten,'yes')
 
+	evict(name[0])
 
 	try:
 		z=pyfits.open(name[0],mode='update')
@@ -342,7 +803,8 @@ def get_image(filename='./11740/ib1cc5gwq_flt.fits',exten=1,rescale='no',fill=0,
 	The purpose of this routine is to allow one to track persistence from sub_arrays to full frame images,
 	and vice versus.  
 
-	The image is actually read by the routine get_image_ext
+	The image is actually read by the routine get_image_ext, or when only part of it is
+	needed, by map_image
 
 	History
 
@@ -352,13 +814,19 @@ def get_image(filename='./11740/ib1cc5gwq_flt.fits',exten=1,rescale='no',fill=0,
 	101203	ksl	Modified call so that is very similar to get_image_ext.  It's possible 
 			get_image_ext should be eliminated
 	120613	ksl	Add parameters to allow one to get a subsection, specified as a list
+	261018		The reference image is no longer read, just its header
+	261018		Only the parts of the source image which are needed are read, using map_image
 	'''
 
 	# Do the simple case first where we are not concerned that we need to map the pixels of one image
 	# into the pixels of another
 
 	if fileref=='none':
-		data=get_image_ext(filename,exten,rescale)
+		if len(section)==4:
+			# Only the section is read
+			data=map_image(filename,exten,rescale)
+		else:
+			data=get_image_ext(filename,exten,rescale)
 		if len(data)==0:
 			print 'Error: get_image: returning empty array for %s extension %d' % (filename,exten)
 		elif len(section)==4:
@@ -375,18 +843,34 @@ def get_image(filename='./11740/ib1cc5gwq_flt.fits',exten=1,rescale='no',fill=0,
 	source_sizes=get_image_pixel_info(filename,exten)
 	# print 'Source sizes',source_sizes
 
-	ref_sizes=get_image_pixel_info(fileref,exten)
+	# Only the header of the reference image is needed
+	ref_sizes=get_image_geometry(fileref,exten)
 	# print 'ref sizes',ref_sizes
+	if len(ref_sizes)==0:
+		print 'Error: get_image: no refdata for file %s' % filename
+		return []
 
-	source_data=get_image_ext(filename,exten,rescale)
+	# The source image is only read where it is needed
+	source_data=map_image(filename,exten,rescale)
 	if len(source_data)==0:
 		print 'Error: get_image: No source data for file %s' % filename
 		return []
 
-	ref_data=get_image_ext(fileref,exten)
-	if len(ref_data)==0:
-		print 'Error: get_image: no refdata for file %s' % filename
-		return []
+	return map_subarray(source_data,source_sizes,ref_sizes,fill)
+
+
+def map_subarray(source_data,source_sizes,ref_sizes,fill=0):
+	'''
+	Map an image, or an ImageMap, onto the pixels of a reference image,
+	given the geometry of both images (see get_image_pixel_info and 
+	get_image_geometry).  The returned array has the size and the dtype 
+	of the reference image.
+
+	History
+
+	261018	Split out of get_image, so that the mapping can be used
+		for images which have already been read
+	'''
 
 	# print 'shapes',numpy.shape(source_data),numpy.shape(ref_data)
 
@@ -399,7 +883,7 @@ def get_image(filename='./11740/ib1cc5gwq_flt.fits',exten=1,rescale='no',fill=0,
 	# print ixmin,ixmax,iymin,iymax
 
 	# 111109 Changed to from zeros_like to zeros to avoid numpy problem
-	z=numpy.zeros(ref_data.shape,dtype=ref_data.dtype)
+	z=numpy.zeros((ref_sizes[0],ref_sizes[1]),dtype=ref_sizes[6])
 
 	z=z+fill
 
@@ -409,7 +893,7 @@ def get_image(filename='./11740/ib1cc5gwq_flt.fits',exten=1,rescale='no',fill=0,
 
 	# print 'test',len(z),iymin,iymax,ixmin,ixmax
 	if iymin >= 0 and ixmin>=0:
-		z[iymin:iymax,ixmin:ixmax]=source_data
+		z[iymin:iymax,ixmin:ixmax]=source_data[:,:]
 	else:
 		iymin=-iymin
 		iymax=iymin+ref_sizes[0]
@@ -450,6 +934,7 @@ def get_image_ext(filename,exten=1,rescale='no'):
 	140606	ksl	Modified so returns an empty numpy array when it fails, instead of a list
 	160103	ksl	Modified print statements slightly to eliminate print unless there is something
 			that looks like it might be an error message
+	261018		Use open_fits.  The array is copied if it belongs to the current session
 	'''
 
 	# Note 'yes' means that even if the filename includes and extension the name that will 
@@ -461,9 +946,9 @@ def get_image_ext(filename,exten=1,rescale='no'):
 
 	# print 'xname',xname
 	try:
-		f=pyfits.open(xname[0])
+		f=open_fits(xname[0])
 		data=f[xname[1]].data
-		f.close()
+		close_fits(f)
 	except IOError:
 		print 'Error: per_fits.get_image_ext: %s does not appear to exist' % filename
 		return numpy.array([])
@@ -471,11 +956,49 @@ def get_image_ext(filename,exten=1,rescale='no'):
 		print 'Error: per_fits.get_image.ext: %s exists, but  ext. %d does not appear to exist' % (filename,exten)
 		return numpy.array([])
 
+	# The rescaled arrays are new arrays, but the array that was read must not be
+	# changed if it belongs to the session
+	raw=data
+
 	if rescale=='no':
+		if fits_session!=None:
+			data=data.copy()
 		return data
+
+	data=rescale_image(data,filename,exten,rescale)
+
+	if data is raw and fits_session!=None:
+		data=data.copy()
+	return data
+
+
+def rescale_image(data,filename,exten=1,rescale='no',values=[]):
+	'''
+	Rescale an array read from a specific extension of a fits file to electrons
+	or counts, as described in get_image_ext, using the keywords in the 
+	header of the file.  If the values of EXPTIME, UNITCORR and BUNIT have
+	already been read, they can be given in values, and the header is not read.
 	
+	The array itself is not changed, but it is returned unchanged if no rescaling 
+	is needed.
+
+	History
+
+	261018	Split out of get_image_ext, so that sections of images can be
+		rescaled in the same way
+	261018	Added values, for read_exposure
+	'''
+
+	if rescale=='no':
+		return data
+
+	xname=parse_fitsname(filename,exten,'yes')
+
 	# print 'try',xname
-	xxxx=get_keyword(xname[0],exten=xname[1],keywords='exptime,unitcorr,bunit',default='Unknown')
+	if len(values)==3:
+		xxxx=values
+	else:
+		xxxx=get_keyword(xname[0],exten=xname[1],keywords='exptime,unitcorr,bunit',default='Unknown')
 	# print 'new',xxxx
 
 
@@ -521,6 +1044,234 @@ def get_image_ext(filename,exten=1,rescale='no'):
 
 	return data
 
+
+class ImageMap(object):
+	'''
+	An image extension of a fits file, from which sections are read only
+	when they are needed.  Slicing an ImageMap, e.g. image[10:20,30:40], 
+	returns a numpy array containing the section, rescaled as for 
+	get_image_ext.  
+
+	filename	the name of the file
+	exten		the extension
+	rescale		the rescaling, see get_image_ext
+	shape		the shape of the image
+	raw		a numpy memmap of the data as it is stored in the file,
+			or None if the image had to be read in its entirety
+	data		the image, if it had to be read in its entirety
+	bscale,bzero	the scaling of the data in the file
+	dtype		the dtype of the data that astropy would return
+
+	Notes:
+
+	For an uncompressed image, only the pages of the file which contain
+	the section are read.  Images which cannot be mapped directly, compressed
+	images, gzipped files and images with BLANK values, are read in their
+	entirety with get_image_ext the first time a section is needed.
+
+	History:
+
+	261018	Coded
+	'''
+
+	def __init__(self,filename,exten,rescale,header,offset):
+		self.filename=filename
+		self.exten=exten
+		self.rescale=rescale
+		self.raw=None
+		self.data=None
+		self.shape=(header['NAXIS2'],header['NAXIS1'])
+
+		self.bscale=header.get('BSCALE',1)
+		self.bzero=header.get('BZERO',0)
+		self.dtype=data_dtype(header)
+
+		if offset!=None:
+			stored={8:'uint8',16:'>i2',32:'>i4',-32:'>f4',-64:'>f8'}[header['BITPIX']]
+			self.raw=numpy.memmap(parse_fitsname(filename,exten)[0],dtype=stored,mode='r',offset=offset,shape=self.shape)
+
+	def __len__(self):
+		return self.shape[0]
+
+	def __getitem__(self,key):
+		'''
+		Return a section of the image as a new array
+		'''
+
+		if self.raw is None:
+			if self.data is None:
+				self.data=get_image_ext(self.filename,self.exten,self.rescale)
+			return self.data[key].copy()
+
+		data=numpy.array(self.raw[key])
+		if self.dtype!=self.raw.dtype:
+			if self.dtype.kind=='f':
+				# This is what astropy does for scaled data
+				data=numpy.array(data,dtype=self.dtype)
+				if self.bscale!=1:
+					data*=self.bscale
+				if self.bzero!=0:
+					data+=self.bzero
+			else:
+				data=numpy.array(data.astype(numpy.int64)+int(self.bzero),dtype=self.dtype)
+
+		return rescale_image(data,self.filename,self.exten,self.rescale)
+
+
+def map_image(filename,exten=1,rescale='no'):
+	'''
+	Return an ImageMap from which sections of a specific extension of a fits file
+	can be read, rescaled as for get_image_ext, without reading the rest of the image.
+	Slicing an ImageMap is like slicing the array that get_image_ext would have 
+	returned.
+
+	An empty numpy array is returned if the routine fails
+
+	History
+
+	261018	Coded
+	'''
+
+	xname=parse_fitsname(filename,exten,'yes')
+
+	try:
+		f=open_fits(xname[0])
+		hdu=f[xname[1]]
+		header=hdu.header
+		info=f.fileinfo(xname[1])
+	except IOError:
+		print 'Error: per_fits.map_image: %s does not appear to exist' % filename
+		return numpy.array([])
+	except IndexError:
+		print 'Error: per_fits.map_image: %s exists, but  ext. %d does not appear to exist' % (filename,exten)
+		close_fits(f)
+		return numpy.array([])
+
+	if header.get('NAXIS')!=2:
+		print 'Error: per_fits.map_image: ext. %d of %s is not an image' % (exten,filename)
+		close_fits(f)
+		return numpy.array([])
+
+	# Only uncompressed images, in files which are not gzipped, can be mapped directly
+	offset=info['datLoc']
+	if isinstance(hdu,pyfits.CompImageHDU) or info['file'].compression!=None:
+		offset=None
+	elif header['BITPIX']==64 or (header['BITPIX']>0 and 'BLANK' in header):
+		offset=None
+
+	close_fits(f)
+	return ImageMap(filename,exten,rescale,header,offset)
+
+class Exposure(object):
+	'''
+	The science and data quality arrays of an exposure, and the keywords
+	that are needed to use them, as returned by read_exposure
+
+	filename	the name of the file
+	sci		the science image, rescaled as requested
+	dq		the data quality image, or an empty array if the file
+			has no data quality extension
+	geometry	the geometry of the science image in the file, see
+			get_image_geometry
+	keywords	a dictionary containing EXPTIME, UNITCORR and BUNIT
+			from the science extension, or if they are not there, the
+			primary header, or 'Unknown' if they are in neither
+
+	History:
+
+	261018	Coded
+	'''
+
+	def __init__(self,filename,sci,dq,geometry,keywords):
+		self.filename=filename
+		self.sci=sci
+		self.dq=dq
+		self.geometry=geometry
+		self.keywords=keywords
+
+
+def read_exposure(filename,rescale='no',fileref='none',fill=0):
+	'''
+	Read the science (extension 1) and data quality (extension 3) images 
+	of an exposure, and the keywords needed to rescale the science image,
+	opening the file only once.
+
+	rescale is as in get_image_ext, and applies only to the science image.  
+	If fileref is not 'none', both images are mapped onto the pixels of 
+	fileref, as in get_image, with fill where the exposure does not cover 
+	fileref.
+
+	The routine returns an Exposure, or None if the file or the science 
+	extension cannot be read.
+
+	History
+
+	261018	Coded, so that stimulus images and masks are read with one open
+	'''
+
+	xname=parse_fitsname(filename)[0]
+
+	try:
+		f=open_fits(xname)
+		sci=f[1]
+		data=sci.data
+		geometry=header_geometry(sci.header,f[0].header)
+	except IOError:
+		print 'Error: per_fits.read_exposure: %s does not appear to exist' % filename
+		return None
+	except IndexError:
+		print 'Error: per_fits.read_exposure: %s exists, but has no science extension' % filename
+		close_fits(f)
+		return None
+	except KeyError,e:
+		print 'Error: per_fits.read_exposure: %s is not found in the science extension of %s' % (e,filename)
+		close_fits(f)
+		return None
+
+	keywords={}
+	for word in ['EXPTIME','UNITCORR','BUNIT']:
+		if word in sci.header:
+			keywords[word]=sci.header[word]
+		elif word in f[0].header:
+			keywords[word]=f[0].header[word]
+		else:
+			keywords[word]='Unknown'
+
+	values=[keywords['EXPTIME'],keywords['UNITCORR'],keywords['BUNIT']]
+	x=rescale_image(data,xname,1,rescale,values)
+
+	try:
+		raw_dq=f[3].data
+		dq_geometry=header_geometry(f[3].header,f[0].header)
+	except (IndexError,KeyError):
+		raw_dq=numpy.array([])
+	dq=raw_dq
+
+	close_fits(f)
+
+	if fileref!='none':
+		ref_sizes=get_image_geometry(fileref,1)
+		if len(ref_sizes)==0:
+			print 'Error: per_fits.read_exposure: no refdata for file %s' % filename
+			return None
+		x=map_subarray(x,geometry,ref_sizes,fill)
+		if len(dq)>0:
+			ref_sizes=get_image_geometry(fileref,3)
+			if len(ref_sizes)>0:
+				dq=map_subarray(dq,dq_geometry,ref_sizes,fill)
+			else:
+				dq=numpy.array([])
+
+	# The arrays must not be shared with the session
+	if fits_session!=None:
+		if numpy.may_share_memory(x,data):
+			x=x.copy()
+		if numpy.may_share_memory(dq,raw_dq):
+			dq=dq.copy()
+
+	return Exposure(filename,x,dq,geometry,keywords)
+
+
 dummy=numpy.array([0])
 
 def rewrite_fits(oldname='old.fits',newname='new.fits',ext=1,data=dummy,clobber='yes'):
@@ -532,9 +1283,17 @@ def rewrite_fits(oldname='old.fits',newname='new.fits',ext=1,data=dummy,clobber=
 	If the oldname and newname are identical the file will simply
 	be updated, something which is dangerous so be careful.
 
+	Notes:
+
+	The old file is not taken from the current session, since its
+	data is replaced here, and the new file is removed from the session.
+
 	100603
+	261018	Remove the new file from the current session
 	'''
 
+	evict(newname)
+
 	if oldname==newname:
 		x=pyfits.open(oldname,'update')
 		x[ext].data=data
@@ -551,6 +1310,167 @@ def rewrite_fits(oldname='old.fits',newname='new.fits',ext=1,data=dummy,clobber=
 	return
 
 
+class ProductWriter(object):
+	'''
+	Write a set of fits files which are all copies of one template file, 
+	each with one extension replaced, reading the template only once.  
+	This replaces a series of calls to rewrite_fits, and put_keyword, 
+	for the same template.
+
+	template	the file which is copied
+	products	a list of the files to be written, each as 
+			[newname,ext,data,keywords,compression,step]
+	thread		the thread which is writing the files, if they are written
+			in the background
+	error		the exception, if any, raised while writing the files
+
+	Notes:
+
+	Add the files with add, and then write them with write.  If they are
+	written in the background, join must be called before the files are used.
+	The arrays must not be changed until the files have been written.
+
+	A file can instead be written in a compact form, which contains only
+	the primary header, the replaced extension as the SCI extension, and 
+	the DQ extension, both tile compressed.  The name of the template, 
+	relative to the directory of the new file, is recorded as SRCFLT in the 
+	primary header, so that the other extensions can be found there (see 
+	get_product_source).  The DQ extension is compressed losslessly with 
+	GZIP_1.  If step is 0, the SCI extension is also lossless, and otherwise 
+	it is quantized with a step of size step (in the units of the image) before 
+	it is compressed, in which case each pixel differs from the original 
+	value by at most step/2.  Readers should locate the extensions of files
+	which may be compact by EXTNAME (see get_ext_number), although the SCI 
+	extension is the first extension in both forms.
+
+	History:
+
+	261018	Coded
+	261018	Added the compact form
+	'''
+
+	def __init__(self,template):
+		self.template=template
+		self.products=[]
+		self.thread=None
+		self.error=None
+
+	def add(self,newname,data,keywords={},ext=1,compression='none',step=0):
+		'''
+		Add a file, which will be the template with the data in extension 
+		ext replaced by data, and the keywords in the dictionary keywords 
+		set.  As in put_keyword, a keyword is set in extension ext if 
+		it is there and otherwise in the primary header.
+
+		If compression is not 'none', the file is written in the compact
+		form, with compression, e.g. 'RICE_1' or 'GZIP_1', used for the
+		SCI extension, which is quantized with step if step is not 0.
+		'''
+
+		self.products.append([newname,ext,data,keywords,compression,step])
+		return
+
+	def write(self,background='no'):
+		'''
+		Write all of the files, in a separate thread if background is 'yes'
+		'''
+
+		for one in self.products:
+			evict(one[0])
+
+		if background=='yes':
+			self.thread=threading.Thread(target=self.run)
+			self.thread.start()
+		else:
+			self.run()
+			self.join()
+		return
+
+	def run(self):
+		'''
+		Write the files.  This is the part of write which may be run in
+		a separate thread.
+		'''
+
+		try:
+			x=pyfits.open(self.template)
+			for one in self.products:
+				newname,ext,data,keywords,compression,step=one
+
+				# Save the original values of the keywords so they can be restored for the next file
+				saved=[]
+				for keyword in keywords.keys():
+					if keyword in x[ext].header:
+						saved.append([ext,keyword,x[ext].header[keyword]])
+						x[ext].header[keyword]=keywords[keyword]
+					elif keyword in x[0].header:
+						saved.append([0,keyword,x[0].header[keyword]])
+						x[0].header[keyword]=keywords[keyword]
+					else:
+						print 'Error: ProductWriter: keyword %s not found in either extension' % keyword
+
+				if os.path.exists(newname):
+					os.remove(newname)
+				if compression=='none':
+					x[ext].data=data
+					x.writeto(newname)
+				else:
+					self.compact(x,newname,ext,data,compression,step).writeto(newname)
+				permissions.set(newname)
+
+				for value in saved:
+					x[value[0]].header[value[1]]=value[2]
+			x.close()
+		except Exception:
+			self.error=sys.exc_info()
+		return
+
+	def compact(self,x,newname,ext,data,compression,step):
+		'''
+		Return the HDUList of the compact form of a file, given the 
+		template x, with its headers already modified
+		'''
+
+		primary=pyfits.PrimaryHDU(header=x[0].header.copy())
+		source=os.path.relpath(os.path.abspath(self.template),os.path.dirname(os.path.abspath(newname)))
+		primary.header['SRCFLT']=(source,'File containing the other extensions')
+
+		header=x[ext].header.copy()
+		header['EXTNAME']='SCI'
+		if step>0:
+			# A negative quantize_level is the size of the quantization step 
+			sci=pyfits.CompImageHDU(data,header=header,compression_type=compression,quantize_level=-step,quantize_method=1)
+		else:
+			sci=pyfits.CompImageHDU(data,header=header,compression_type=compression,quantize_level=0.0)
+		hdus=[primary,sci]
+
+		try:
+			dq=x['DQ']
+			hdus.append(pyfits.CompImageHDU(dq.data,header=dq.header.copy(),compression_type='GZIP_1'))
+		except KeyError:
+			pass
+
+		if 'NEXTEND' in primary.header:
+			primary.header['NEXTEND']=len(hdus)-1
+		return pyfits.HDUList(hdus)
+
+	def join(self):
+		'''
+		Wait for the files to be written, and raise any exception
+		that occurred in writing them
+		'''
+
+		if self.thread!=None:
+			self.thread.join()
+			self.thread=None
+
+		if self.error!=None:
+			error=self.error
+			self.error=None
+			raise error[0],error[1],error[2]
+		return
+
+
 
 def get_times(filename):
         '''
@@ -608,9 +1528,10 @@ def get_ext_info(filename,type='SCI'):
 			might be better to have a routine which gets all of the
 			extensions of a certain type and another routine which
 			gets a keyword from each of the extensions
+	261018	Use open_fits
 	'''
 	try:
-		z=pyfits.open(filename)
+		z=open_fits(filename)
 	except IOError:
 		print 'Error: get_ext_info: file %s not found' % filename
 		return []
@@ -637,7 +1558,7 @@ def get_ext_info(filename,type='SCI'):
 
 
 		i=i+1
-	z.close()
+	close_fits(z)
 	return ext
 
 def doit(filename):
@@ -17,10 +17,21 @@ where 	fileroot     the root name of the outputfiles
 	-h		Print this help
 	-all		Create a new .ls file and a new summary file
 	-new_sum 	Create a new summary file
-	-daily		Create a new .ls but just update the old summary file
+	-daily		Create a new .ls but just update the old summary file.  Only
+			files which are new, or have changed, since the last run are
+			inspected (see make_ordered_list)
 	-file_type	Instead of the defult flt files, create a file continaing
 			a different file type, e.g. -file_type raw  to get the
 			raw data files
+	-np n		Inspect the files with n processes
+	-io_threads n	Read n files at a time in each process, which helps
+			when the files are on a network file system
+	-walk_threads n	Use n threads to walk the directory structure
+	-sum_db		Keep the summary in a database, fileroot.sum.db, which 
+			several processes can update at once, and from which
+			the summary file is written (see summary_db).  Once the
+			database exists it is always used.
+	-export_sum	Just write the summary file from the database
 
 without any arguments the call is effectively
 
@@ -43,7 +54,7 @@ related to where the Persist directories are located.
 
 Description:  
 
-	The routine uses 'find' to locate all of the files of a certain type,
+	The routine uses find.walk_files to locate all of the files of a certain type,
 	aand then orders the list in time.  If there are duplicate files then
 	it uses the creation date as the one to put in the list.  The dupliccates
 	are in the list also, but are commented out. 
@@ -55,7 +66,6 @@ Primary routines:
 	make_sum_file		Creates/updates the summary file
 
 Notes:
-	This should probably be rewritten to remove the iraf dependencies
 									   
 History:
 
@@ -79,6 +89,11 @@ History:
 130909 ksl	Standardized error printouts
 150317	ksl	Remove iraf/pyraf from per_list
 151022	ksl	Restored iraf/pyraf for performance reasons
+261018		Removed iraf/pyraf again, replacing hselect with a routine
+		which reads the fits headers directly
+261018		Replaced the unix utility find with find.walk_files, and 
+		find_latest with find.find_best, which uses an index of the
+		directory structure
 160104	ksl	Changes to lock and unlock files so that parallel processing
 		will not corrupt the obervations.sum file
 
@@ -95,9 +110,14 @@ import subprocess
 import pylab
 import shutil
 import per_fits
+import find
 from astropy.io import fits
-import pyraf
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import heapq
+import sqlite3
+from numpy.lib.format import open_memmap
+import itertools
 
 
 # Utilities
@@ -336,7 +356,7 @@ def parse_creation_time(xtime='2010-07-10T19:11:52'):
 
 	return pseudo_time
 
-def check4duplicates(records):
+def check4duplicates(records,report='no'):
 	'''
 	Check the list 4 duplicate records, and choose the one that was
 	created last if that is possible
@@ -344,56 +364,54 @@ def check4duplicates(records):
 	The routine returns a list that contains 'ok' for files that 
 	are the ones to use and 'nok' for those that are duplicates
 
+	If report is 'yes', each of the files that has been superseded
+	is printed out, along with the file that is used instead.
+
+	Notes:
+
+	If two versions of a dataset were created at the same time, the one
+	that comes later in records is used.
+
 	100817	Added checks to trap problems parsing times.
 	110120	This is a new attempt to find the duplicates and select the last one
 	160127  Modified again to speed this up (when there are large numbers of files
 		to examine.  If there are no duplicates this is quite quick.  Even
 		when there are duplicates this is about 3x faster than the old method.
+	261018	Find the best version of each dataset in a single pass through the 
+		records, so the time no longer grows as the square of the number of 
+		records when there are many duplicates.  Added report.
 	'''
 
 
 	xstart=time.time()
 
+	# The index of the best version of each dataset so far
+	best={}
 	ok=[]
-	names=[]
-	for record in records:
-		ok.append('ok')
-		names.append(record[1])
+	i=0
+	while i<len(records):
+		name=records[i][1]
+		j=best.get(name)
+		if j==None or records[i][17]>=records[j][17]:
+			best[name]=i
+		ok.append('nok')
+		i=i+1
+
+	for i in best.itervalues():
+		ok[i]='ok'
 	
-	unique=set(names)
-	if len(unique)==len(names):
+	if len(best)==len(records):
 		print 'check4duplicates: There are no duplicates in the directory structure'
 		return ok
-	else:
-		duplicate_names=[]
-		print 'check4duplicates: Warning: There are %d duplicate datasets in the directory structure' % (len(names)-len(unique))
-		for one in unique:
-			icount=names.count(one)
-			if icount>1:
-				duplicate_names.append(one)
-				hold=[]
-				j=0
-				while j<len(records):
-					if names[j]==one:
-						hold.append(j)
-						if len(hold)==icount:
-							break   # We have them all
-					j=j+1
-				times=[]
-				for one in hold:
-					times.append(records[one][17])
-
-				times=numpy.array(times)
-				order=numpy.argsort(times) # Give me the order of the times
-				last=order[len(order)-1]
-
-				k=0
-				while k<len(hold):
-					if k==last:
-						ok[hold[k]]='ok'
-					else:
-						ok[hold[k]]='nok'
-					k=k+1
+
+	print 'check4duplicates: Warning: There are %d duplicate datasets in the directory structure' % (len(records)-len(best))
+
+	if report=='yes':
+		i=0
+		while i<len(records):
+			if ok[i]=='nok':
+				print 'check4duplicates: %s is superseded by %s' % (records[i][0],records[best[records[i][1]]][0])
+			i=i+1
 
 	print 'Check for duplicates in direcory structure took:',time.time()-xstart
 
@@ -414,38 +432,20 @@ def find_latest(filename='foo'):
 
 	Notes:
 
-	This routine uses the unix utility find.  It is therefore
-	likely to be slow in large directory structures
-
-	This uses subprocess which handles stdin and stdout, unlike
-	os.system
+	The work is done by find.find_best, which looks first in the index
+	of the directory structure that is written by make_ordered_list, 
+	and only walks the directory structure if the file is not there.
 
 	History:
 
 	100906 ksl Coding begun.  There is a standalone version of this 
 		   called find.py (in my normal py_progs/scripts directory
+	261018	   Use find.find_best rather than the unix utility find
 
 
 	'''
 
-	proc=subprocess.Popen('find . -follow -name %s -print ' % filename,shell=True,stdout=subprocess.PIPE)
-	# Before
-	lines=proc.stdout.readlines()
-	if len(lines)==0:
-			'Warning: find_best: No versions of %s found' % filename
-			return ''
-	tbest=0
-	for line in lines:
-		fname=line.strip()
-		if fname.count('/') <= 1:
-			fbest=fname
-			break
-		else:
-			time=os.path.getmtime(fname)
-			if time>tbest:
-				fbest=fname
-				tbest=time
-	return fbest
+	return find.find_best(filename)
 
 
 
@@ -471,6 +471,8 @@ def check4scan(filename='./Visit43/ic9t43j1q_flt.fits[1]'):
 	130225  Coded and Debugged
 	130307  Replaced routine using astropy.fits with iraf because astropy.fits
 		was very slow
+	261018	Replaced iraf with per_fits.get_header_keywords, which only reads
+		the header
 	'''
 
 	xscan='unknown'
@@ -484,10 +486,9 @@ def check4scan(filename='./Visit43/ic9t43j1q_flt.fits[1]'):
 
 	# Now we should have the name of the spt file
 	if os.path.exists(xfile)==True:
-		# Revert to iraf/pyraf for performance reasons
-		# xx=per_fits.get_keyword(xfile,0,'SCAN_TYP')
-		xx=pyraf.iraf.hselect(xfile+'[0]','SCAN_TYP','yes',Stdout=1)
-		xx=xx[0].split('\t')
+		xx=per_fits.get_header_keywords(xfile,0,'SCAN_TYP')
+		if len(xx)==0:
+			xx=['']
 	else: 
 		return 'no_spt'
 
@@ -545,16 +546,37 @@ def update_summary(dataset,status_word='Unknown',results='Whatever you want',fil
 			needs to be careful that there is no possibility that one is
 			indexing to the wrong position.
 	160105	ksl	Modified for multiprocessing
+	261018		If there is a summary database (see summary_db), the record 
+			is updated there directly instead.  The line itself is now
+			made by make_summary_line
 
 	'''
 
+	gmt=time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+	db=summary_db(fileroot)
+	if db!=None:
+		db.execute('BEGIN IMMEDIATE')
+		try:
+			row=db.execute('SELECT line FROM summary WHERE dataset=?',(dataset,)).fetchone()
+			if row==None:
+				print 'Error: update_summary: Dataset %s is not in %s.sum.db' % (dataset,fileroot)
+				db.execute('ROLLBACK')
+				return
+			string=make_summary_line(str(row[0]),status_word,results,append,gmt)
+			db.execute('UPDATE summary SET line=? WHERE dataset=?',(string,dataset))
+			db.execute('COMMIT')
+		except:
+			db.execute('ROLLBACK')
+			raise
+		return
+
 
 	if os.path.isdir('tmp_sum')==False:
 		os.mkdir('tmp_sum')
 	
 
 	summary_file=fileroot+'.sum'
-	gmt=time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
 
 
 	try:
@@ -583,6 +605,25 @@ def update_summary(dataset,status_word='Unknown',results='Whatever you want',fil
 	
 	# OK at this point I have the old results
 
+	string=make_summary_line(old_results,status_word,results,append,gmt)
+
+	gg=open_file('tmp_sum/%s.txt' % dataset)
+	gg.write('%s\n' % string)
+	gg.close()
+
+	return
+
+def make_summary_line(old_results,status_word,results,append,gmt):
+	'''
+	Return the new line of the summary file for a dataset, given the old
+	line, old_results, and the inputs of update_summary.  gmt is the 
+	time of the update.
+
+	History:
+
+	261018	Split from update_summary
+	'''
+
 	results=results.strip()
 
 	old_results=old_results.strip()
@@ -597,11 +638,7 @@ def update_summary(dataset,status_word='Unknown',results='Whatever you want',fil
 		results='%s %s' % (old_results,results)
 	string='%-10s %5s %20s  %20s %-20s %s' % (line[0],line[1],line[2],gmt,status_word,results)
 
-	gg=open_file('tmp_sum/%s.txt' % dataset)
-	gg.write('%s\n' % string)
-	gg.close()
-
-	return
+	return string
 
 
 
@@ -618,74 +655,223 @@ def  fixup_summary_file(datasets,fileroot='observations'):
 		The directory where the data is stored is hardwired
 
 		The routine simple finds the line in the observations.sum file associated with
-		the dataset and replaces that line with the line that is in the .txt file
+		the dataset and replaces that line with the line that is in the .txt file.
+		The .txt files are removed afterwards.
 	
 	History:
 
 	160105	ksl	Coded as part of the effort to add multiprocessing
+	261018		If there is a summary database, the results are already there,
+			and the summary file is simply exported from it
+	261018		Look up the results for each line in a dictionary, rather than
+			searching through all of the datasets, write the new file in
+			the same directory and rename it instead of using mv, and remove
+			the files in tmp_sum once they have been merged
 
 	'''
 
+	if summary_db(fileroot)!=None:
+		export_summary(fileroot)
+		return
+
 
 	# Get the data
-	good=[]
-	data=[]
+	data={}
 	for dataset in datasets:
 		try:
 			xname='tmp_sum/%s.txt' % dataset
 			f=open(xname,'r')
 			line=f.readline()
-			data.append(line)
-			good.append(dataset)
+			f.close()
+			data[dataset]=line
 		except IOError:
 			print 'Error: fixup_summary_file: %s does not appear to exist' % xname
 	
 	# OK at this point we have found all of the good files
 
 	summary_file=fileroot+'.sum'
+	tmpfile='%s.%d.tmp' % (summary_file,os.getpid())
 
 	try:
 		f=open(summary_file,'r')
-		lines=f.readlines()
-		f.close()
 	except IOError:
 		print 'Error: update_summary: File %s does not exist' % summary_file
 		return
 
+	g=open_file(tmpfile)
+	for line in f:
+		words=line.split()
+		if len(words)>0 and words[0] in data:
+			line=data[words[0]]
+			print line.strip()
+		g.write(line)
+	g.close()
+	f.close()
+
+	backup(summary_file)
+	os.rename(tmpfile,summary_file)
+
+	# The results are now in the summary file, so they are not needed any more
+	for dataset in data:
+		try:
+			os.remove('tmp_sum/%s.txt' % dataset)
+		except OSError:
+			pass
+
+	return
+
+
+
+
 
-	i=0
-	while i<len(lines):
-		line=lines[i].split()
-		j=0
-		while j<len(good):
-			if line[0]==good[j]:
-				lines[i]=data[j]
-				print lines[i].strip()
-				break
-			j=j+1
-		i=i+1
 	
 
-	g=open_file('tmp.sum')
-	for one in lines:
-		g.write(one)
 
 
 
+# The summary database.  If a file fileroot.sum.db exists, it, rather than fileroot.sum, is the 
+# record of the persistence processing.  It is an sqlite database, in WAL mode so that several
+# processes can update it at the same time, with a table summary which contains the line of the
+# summary file for each dataset, and the position of the line in the file.  update_summary
+# changes the line for a dataset there directly, and fixup_summary_file and make_sum_file 
+# export fileroot.sum from it, so that fileroot.sum can still be read as before.  Use
+# make_summary_db (per_list.py -sum_db) to create the database from an existing summary file.
 
-	backup(summary_file)
-	proc=subprocess.Popen('mv %s %s' % ('tmp.sum',summary_file),shell=True,stdout=subprocess.PIPE)
+summary_dbs={}
+
+def summary_db(fileroot='observations',create='no'):
+	'''
+	Return a connection to the summary database fileroot.sum.db, or None
+	if there is no database and create is not 'yes'.  Each process has
+	its own connection.
+
+	History:
+
+	261018	Coded
+	'''
+
+	filename=fileroot+'.sum.db'
+	key=(os.path.abspath(filename),os.getpid())
+	if key in summary_dbs:
+		return summary_dbs[key]
+
+	if create!='yes' and os.path.isfile(filename)==False:
+		return None
+
+	db=sqlite3.connect(filename,timeout=600,isolation_level=None)
+	db.execute('PRAGMA journal_mode=WAL')
+	db.execute('CREATE TABLE IF NOT EXISTS summary (dataset TEXT PRIMARY KEY, position INTEGER, line TEXT)')
+	db.execute('CREATE INDEX IF NOT EXISTS summary_position ON summary (position)')
+	try:
+		os.chmod(filename,0770)
+	except OSError:
+		pass
+
+	summary_dbs[key]=db
+	return db
+
+def make_summary_db(fileroot='observations'):
+	'''
+	Create the summary database, fileroot.sum.db, from the current
+	summary file, fileroot.sum.  Any records already in the database
+	are replaced.
+
+	History:
+
+	261018	Coded
+	'''
+
+	summary_file=fileroot+'.sum'
+	try:
+		f=open(summary_file,'r')
+	except IOError:
+		print 'Error: make_summary_db: File %s does not exist' % summary_file
+		return
 
+	db=summary_db(fileroot,create='yes')
+	db.execute('BEGIN IMMEDIATE')
+	try:
+		db.execute('DELETE FROM summary')
+		i=0
+		for line in f:
+			words=line.split()
+			if len(words)==0:
+				continue
+			db.execute('INSERT OR REPLACE INTO summary VALUES (?,?,?)',(words[0],i,line.rstrip('\n')))
+			i=i+1
+		db.execute('COMMIT')
+	except:
+		db.execute('ROLLBACK')
+		raise
+	f.close()
+
+	print '# Created %s.sum.db with %d records' % (fileroot,i)
 	return
 
+def export_summary(fileroot='observations'):
+	'''
+	Write the summary file fileroot.sum from the summary database.  The
+	file is written to a temporary file in the same directory, which then
+	replaces the old one.
 
+	History:
 
+	261018	Coded
+	'''
 
+	db=summary_db(fileroot)
+	if db==None:
+		print 'Error: export_summary: There is no summary database %s.sum.db' % fileroot
+		return
 
-	
+	summary_file=fileroot+'.sum'
+	tmpfile='%s.%d.tmp' % (summary_file,os.getpid())
+
+	g=open_file(tmpfile)
+	for row in db.execute('SELECT line FROM summary ORDER BY position'):
+		g.write('%s\n' % str(row[0]))
+	g.close()
+
+	backup(summary_file)
+	os.rename(tmpfile,summary_file)
+	return
 
+def update_summary_db(fileroot,records,gmt,new='no'):
+	'''
+	Make the summary database agree with the records of the .ls file, for
+	make_sum_file.  Records which are new are added as Unprocessed,
+	the records for datasets which are no longer in the .ls file are
+	removed, and the rest are put in the order of the .ls file.  If new is
+	'yes', all of the records are replaced.
 
+	History:
 
+	261018	Coded
+	'''
+
+	db=summary_db(fileroot)
+	db.execute('BEGIN IMMEDIATE')
+	try:
+		if new=='yes':
+			db.execute('DELETE FROM summary')
+		else:
+			db.execute('UPDATE summary SET position=-1')
+		i=0
+		nnew=0
+		for record in records:
+			if db.execute('UPDATE summary SET position=? WHERE dataset=?',(i,record[1])).rowcount==0:
+				string='%-10s %5s %20s  %20s %-20s' % (record[1],record[2],record[6],gmt,'Unprocessed')
+				db.execute('INSERT INTO summary VALUES (?,?,?)',(record[1],i,string))
+				nnew=nnew+1
+			i=i+1
+		nremoved=db.execute('DELETE FROM summary WHERE position<0').rowcount
+		db.execute('COMMIT')
+	except:
+		db.execute('ROLLBACK')
+		raise
+
+	print '# Added %d new records to and removed %d records from %s.sum.db' % (nnew,nremoved,fileroot)
+	return
 
 def make_sum_file(fileroot='observations',new='no'):
 	'''
@@ -705,6 +891,8 @@ def make_sum_file(fileroot='observations',new='no'):
 			file
 	110119	ksl	Rewrote to assure that there is exactly one summary 
 			file line for each observation file line
+	261018		If there is a summary database, update it and then export
+			the summary file from it
 	'''
 
 
@@ -718,6 +906,11 @@ def make_sum_file(fileroot='observations',new='no'):
 
 	summary_file=fileroot+'.sum'
 
+	if summary_db(fileroot)!=None:
+		print '# Merging new records into the summary database'
+		update_summary_db(fileroot,records,gmt,new)
+		export_summary(fileroot)
+		return
 
 	if os.path.exists(summary_file)==False or new=='yes':
 		print '# Making a pristine summary file'
@@ -946,10 +1139,63 @@ def check_sum_file(new='tmp.sum',old='none'):
 
 
 
-def get_info(lines,apertures,filetype):
+def get_one_info(filename,apertures,filetype):
+	'''
+	Get all of the keyword information for a single file
+
+	The routine returns the record for the file, an empty list if the file
+	exists but is not one that belongs in the .ls file (because it is not an
+	IR file, or it is a subarray and apertures is 'full'), or None if the file 
+	could not be accessed.
+
+	History
+
+	261018	Split from get_info, so that single files can be inspected by the
+		incremental version of make_ordered_list
+	261018	Replaced iraf.hselect with per_fits.get_header_keywords
+	'''
+
+	# 100807 Added date of file creation so could handle non-unique data sets
+	# 261018 The headers are now read with per_fits.get_header_keywords, which like hselect 
+	# looks in the extension and then in the primary header, and returns INDEF for missing keywords
+	xfile='%s[1]' % filename
+	x=per_fits.get_header_keywords(filename,1,'rootname,proposid,linenum, instrume,detector,expstart,date-obs,time-obs,aperture,filter,exptime,crval1,crval2,targname,asn_id,pr_inv_L,date')
+	if len(x)>0:
+		x=[filename]+x
+
+		x[16]=x[16].replace(' ','-')  # Get rid of spaces in PI names
+		# Another kludge for raw files.  The is no 'date' field in the first extension as there is for flt and ima files, but DATE does exist in extension 0
+		if filetype=='raw':
+			x[17]=per_fits.get_header_keywords(filename,0,'date')[0]
+
+		scan=check4scan(xfile)
+
+		if x[5]=='IR':
+			x[4]=scan
+			j=string.count(x[9],'SUB')
+			if j == 0 or apertures != 'full':
+				return x
+		return []
+	else: 
+		print 'File %s does not really exist' %  xfile
+		return None
+
+def get_info(lines,apertures,filetype,io_threads=1):
 	'''
 	Get all of the keyword information for a set of files and return this
 
+	The routine returns the times and records of the files that belong in the
+	.ls file, and a list of [filename,record] for all of the files that could 
+	be accessed, where the record is empty for files that do not belong in
+	the .ls file.
+
+	lines can be a list, or a generator such as find.walk_files, in which case
+	the files are inspected as they are found.
+
+	If io_threads is greater than 1, that many files are read at the same
+	time using a pool of threads.  This helps when the files are on a network
+	file system, where most of the time is spent waiting for each file.
+
 	Notes:
 
 	This section of the old make_ordered list was put into a separate function
@@ -958,72 +1204,85 @@ def get_info(lines,apertures,filetype):
 	History
 
 	160118	ksl	Added
+	261018		The work for each file is now done in get_one_info, and
+			the results for each file are also returned
+	261018		Added io_threads, and the rate at which files are read
+			to the progress reports
+	261018		lines can be a generator
 	'''
 
 	records=[]
 	times=[]
+	inspected=[]
 
-	if len(lines)==0:
-		print 'There were no %s files in the directory structure' % filetype
-		return []
-	else:
+	# lines may also be a generator, in which case the number of files is not known in advance
+	if isinstance(lines,list):
+		if len(lines)==0:
+			print 'There were no %s files in the directory structure' % filetype
+			return [],[],[]
 		print 'There are %d datasets to process' % len(lines)
+		ntot='%6d' % len(lines)
+	else:
+		ntot='     ?'
 
-	i=0
-	for line in lines:
+	inputs=info_inputs(lines,apertures,filetype)
 
-		line=line.strip()
-		line=line.split()
+	if io_threads>1:
+		pool=ThreadPool(io_threads)
+		results=pool.imap(one_info_helper,inputs,16)
+	else:
+		pool=None
+		results=itertools.imap(one_info_helper,inputs)
+
+	xstart=time.time()
+	i=0
+	for filename,x in results:
+		if x!=None:
+			inspected.append([filename,x])
+			if len(x)>0:
+				records.append(x)
+				times.append(float(x[6]))
 
-		# 100807 Added date of file creation so could handle non-unique data sets
-		# This is the old version using pyraf, which has been put back for perfomance reasons
-		xfile='%s[1]' % line[0]
-		if pyraf.iraf.imaccess(xfile):
-			x=pyraf.iraf.hselect(xfile,'$I,rootname,proposid,linenum, instrume,detector,expstart,date-obs,time-obs,aperture,filter,exptime,crval1,crval2,targname,asn_id,pr_inv_L,date','yes',Stdout=1)
-			x=x[0].split('\t')
-			# Kluge for raw data files which have two ROOTNAME keywords for unknown reasons
-			if x[1]==x[2]:
-				x.pop(2)
-
-			x[16].replace(' ','-')  # Get rid of spaces in PI names
-			# Another kludge for raw files.  The is no 'date' field in the first extension as there is for flt and ima files, but DATE does exist in extension 0
-			if filetype=='raw':
-				xname=per_fits.parse_fitsname(xfile,0,'yes')
-				xx=pyraf.iraf.hselect(xname[2],'$I,DATE','yes',Stdout=1)
-				xx=xx[0].split('\t')
-				x.append(xx[1])
-			x[0]=line[0]
-
-#		# Replaced upcoming lines with iraf/pyraf for performance reasons
-#		xfile=line[0]
-#		if os.path.isfile(xfile) == True:
-#			x=per_fits.get_keyword(xfile,1,'rootname,proposid,linenum, instrume,detector,expstart,date-obs,time-obs,aperture,filter,exptime,crval1,crval2,targname,asn_id,pr_inv_L')
-#			x=[xfile]+x
-
-#			# for raw files the date is in extension 0, but for the others it is in 1.
-#			if filetype=='raw':
-#				date=per_fits.get_keyword(xfile,0,'date')
-#			else:
-#				date=per_fits.get_keyword(xfile,1,'date')
-#			x.append(date[0])
-
-
-
-			scan=check4scan(xfile)
-
-			if x[5]=='IR':
-				x[4]=scan
-				j=string.count(x[9],'SUB')
-				if j == 0 or apertures != 'full':
-					records.append(x)
-					times.append(float(x[6]))
-		else: 
-			print 'File %s does not really exist' %  xfile
 		i=i+1
 		if i%100 == 1:
-			print 'Inspected %6d of %6d datasets --> %6d IR datasets' % (i,len(lines),len(records))
-	print 'Inspected %6d of %6d datasets --> %6d IR datasets' % (i,len(lines),len(records))
-	return times,records
+			print 'Inspected %6d of %s datasets --> %6d IR datasets (%.1f files/s)' % (i,ntot,len(records),i/max(time.time()-xstart,1e-6))
+	if i==0:
+		print 'There were no new or modified %s files to inspect' % filetype
+	print 'Inspected %6d of %s datasets --> %6d IR datasets (%.1f files/s)' % (i,ntot,len(records),i/max(time.time()-xstart,1e-6))
+
+	if pool!=None:
+		pool.close()
+		pool.join()
+
+	return times,records,inspected
+
+def one_info_helper(args):
+	'''
+	This repackages the argments of get_one_info so they can be passed as 
+	a single argument by the pool of threads in get_info. The file name is
+	returned along with the results
+
+	History
+
+	261018	Coded
+	'''
+
+	return args[0],get_one_info(*args)
+
+def info_inputs(lines,apertures,filetype):
+	'''
+	Generate the arguments of get_one_info for each of the lines, which 
+	contain a file name as the first word.
+
+	History
+
+	261018	Coded
+	'''
+
+	for line in lines:
+		line=line.split()
+		if len(line)>0:
+			yield [line[0],apertures,filetype]
 
 
 def info_helper(args):
@@ -1034,13 +1293,30 @@ def info_helper(args):
 
 	The issue here is that you only can pass a single argument via the Pool mechanism.
 	This simple allows that.
+
+	The first argument is the name of a file to which the records that are
+	found are written in time order (see write_run), so that they do not
+	have to be passed back.  The routine returns the name of this file, the
+	number of files that were inspected, and [filename,[]] for each of
+	the files which do not belong in the .ls file.
+
+	History
+
+	261018		Write the records to a file rather than returning them
 	'''
 
-	return get_info(*args)
+	times,records,inspected=get_info(*args[1:])
+	write_run(args[0],records,times)
+
+	skipped=[]
+	for one in inspected:
+		if len(one[1])==0:
+			skipped.append(one)
+	return [args[0],len(inspected),skipped]
 
 
 
-def make_ordered_list(fileroot='observations',apertures='full',filetype='flt',new='no',np=1):
+def make_ordered_list(fileroot='observations',apertures='full',filetype='flt',new='no',np=1,incremental='no',io_threads=1,walk_threads=1):
 	'''
 	find all of the observations in all subdiretories and make
 	a time ordered list of the observations from files of a
@@ -1052,7 +1328,30 @@ def make_ordered_list(fileroot='observations',apertures='full',filetype='flt',ne
 	Note - This could be done as a true database, but it's 
 	simpler for now just to make it a file
 
-	This routine still uses iraf.hselect
+	io_threads is the number of files read at the same time by each process
+	(see get_info).
+
+	The files are found with find.walk_files, using walk_threads threads to
+	walk the directory tree, rather than with the unix find command.  
+	Directories reached through more than one symbolic link are only 
+	visited once.  Unless np>1, the files are inspected as they are found.
+	The directories that were walked are saved in an index which find_latest 
+	uses to locate files.
+
+	The records are put in time order in runs, one for the records found
+	by each process, which are written to temporary files, and one for the
+	records which are unchanged since the last run, and these are then merged
+	by write_ordered_runs as the .ls file is written.  So the routine does
+	not need to hold all of the records at once, and returns the number of
+	records rather than the records themselves.
+
+	If incremental is 'yes', the manifest written by the last run (see
+	read_manifest) is used so that only files which are new, or whose size
+	or modification time has changed, are inspected.  Records for files which
+	no longer exist are dropped, and the new records are merged into the time 
+	order of the old ones.
+
+	The headers are read by get_one_info
 
 	100308 - Added option to deal with other types of files aside from flt files.  The 
 		assumption made is that the filetype is part of the filename
@@ -1078,6 +1377,12 @@ def make_ordered_list(fileroot='observations',apertures='full',filetype='flt',ne
 	160118  Added the possibility of running multiple processors
 	160119  Switched from time.clock to time.time so that everything would be in wall clock
 		time
+	261018	Added the incremental option, and the manifest which makes it possible
+	261018	Added io_threads
+	261018	Replaced the unix find command with find.walk_files, so files.ls
+		is no longer written, and added walk_threads
+	261018	Sort the records from each process separately, and merge them as 
+		the file is written
 	'''
 
 	if filetype!='flt':
@@ -1086,18 +1391,40 @@ def make_ordered_list(fileroot='observations',apertures='full',filetype='flt',ne
 
 	backup(fileroot+'.ls')
 	xstart=time.time()
-	os.system('find . -follow -name \*%s.fits  -print 1>files.ls 2>/tmp/foo; rm /tmp/foo' % filetype)
-	search_time=dtime=time.time()-xstart
-	print '# Found all of the files to read in %f s' % dtime
-	xstart=time.time()
 
+	# Find out which files have to be inspected, and which are unchanged since the last run
+	manifest={}
+	if incremental=='yes':
+		manifest=read_manifest(fileroot)
+
+	stamps={}
+	kept=[]
+	index={}
+	lines=select_files(find.walk_files('.','*%s.fits' % filetype,walk_threads,index),manifest,stamps,kept)
+
+	# Unless the files are split between processes, the directories are walked as the files are inspected 
+	search_time=0
+	if np>1:
+		lines=list(lines)
+		search_time=dtime=time.time()-xstart
+		print '# Found all of the files to read in %f s' % dtime
+		xstart=time.time()
 
-	f=open('files.ls','r')
-	lines=f.readlines()
-	f.close()
-
+	# Each set of records is put in time order, as a run which is either held
+	# in memory, or, for the records found by other processes, in a file
+	runs=[]
+	skipped=[]
 	if np<=1 or len(lines)<np:
-		times,records=get_info(lines,apertures,filetype)
+		times,records,inspected=get_info(lines,apertures,filetype,io_threads)
+		ninspected=len(inspected)
+		run=[]
+		for i in numpy.argsort(times,kind='mergesort'):
+			run.append(records[i])
+		runs.append(run)
+		for one in inspected:
+			if len(one[1])==0:
+				skipped.append(one)
+		times=records=inspected=[]
 	else:
 		inputs=[]
 		idelta=len(lines)/np +1
@@ -1108,67 +1435,369 @@ def make_ordered_list(fileroot='observations',apertures='full',filetype='flt',ne
 			if imax>len(lines):
 				imax=len(lines)
 			xinputs=lines[imin:imax]
-			inputs.append([xinputs,apertures,filetype])
+			runfile='%s.ls.%d.%03d.run' % (fileroot,os.getpid(),len(inputs))
+			inputs.append([runfile,xinputs,apertures,filetype,io_threads])
 			i=i+idelta
 
-		# i=0
-		# while i<len(inputs):
-		# 	print i,inputs[i]
-		# 	i=i+1
-
 		p=Pool(np)  
 
-		times=[]
-		records=[]
+		ninspected=0
 		for one in p.map(info_helper,inputs):
-			times=times+one[0]
-			records=records+one[1]
-	
-
-	# print 'times',len(times)
-	# print 'records',len(records)
+			runs.append(one[0])
+			ninspected=ninspected+one[1]
+			skipped.extend(one[2])
+		p.close()
+		p.join()
 
 	key_time=dtime=time.time()-xstart
 	print 'Inspected all of the files in %f s' % dtime
-	
 
-	if len(times)==0:
-		print 'There were no IR observations to consider'
-		return []
-	# Now sort this all on the time
-	# This returns an index of the order of the lines
+	if incremental=='yes':
+		nremoved=0
+		for one in manifest:
+			if one not in stamps:
+				nremoved=nremoved+1
+		print '# %d files were unchanged, %d were new or modified, and %d have been removed since the last run' % (len(kept),ninspected,nremoved)
+
+	# Save the index of all the files that were seen, for find_latest
+	find.write_index(index)
+
+	# The records which are unchanged since the last run come first when times are the same
 	xstart=time.time()
-	order=numpy.argsort(times)
+	times=[]
+	records=[]
+	for one in kept:
+		if len(one[1])==0:
+			skipped.append(one)
+		else:
+			records.append(one[1])
+			times.append(float(one[1][6]))
+	run=[]
+	for i in numpy.argsort(times,kind='mergesort'):
+		run.append(records[i])
+	runs.insert(0,run)
+	times=records=kept=[]
+
 	sort_time=dtime=time.time()-xstart
 	print '# Time to sort the records %s s' % dtime
 
-	lastime=float(records[len(order)-1][6])
+	# Now merge the runs, and write the time sorted file
+	xstart=time.time()
+	try:
+		nrecords=write_ordered_runs(fileroot,runs)
+		write_time=time.time()-xstart
+		print '# Time to write the .ls file  %s s' % write_time
+
+		# Record what was found for each file for the next incremental run
+		if nrecords>0:
+			write_manifest(fileroot,itertools.chain(manifest_entries(runs),skipped),stamps)
+	finally:
+		for run in runs:
+			if isinstance(run,str) and os.path.exists(run):
+				os.remove(run)
+
+	if nrecords==0:
+		print 'There were no IR observations to consider'
+		return 0
+
+	print '# Completed creating %s.ls' % (fileroot)
+
+	print '# make_ordered_list: times',search_time,key_time,sort_time,write_time
+
+	return nrecords
+
+def select_files(paths,manifest,stamps,kept):
+	'''
+	Generate the paths which need to be inspected by make_ordered_list,
+	that is those which are not in the manifest from the last run, or
+	whose size or modification time has changed.
+
+	As a side effect, the [size,mtime] of each file are added to the
+	dictionary stamps, and [path,record] for each file which is unchanged 
+	is added to the list kept.
+
+	History
+
+	261018	Coded
+	'''
+
+	for path in paths:
+		try:
+			stat=os.stat(path)
+			stamps[path]=[stat.st_size,stat.st_mtime]
+		except OSError:
+			yield path
+			continue
+		entry=manifest.get(path)
+		if entry!=None and entry[0:2]==stamps[path]:
+			kept.append([path,entry[2]])
+		else:
+			yield path
 	
-	time_sorted=[]
-	for index in order:
-		time_sorted.append(records[index])
+def write_run(filename,records,times):
+	'''
+	Write records to a file in the order of times, as one of the sorted runs 
+	which are merged by write_ordered_runs.  Each line of the file contains
+	the words of one record separated by tabs.
 
-	# Now check for uniqueness files
+	History:
 
+	261018	Coded
+	'''
 
+	f=open_file(filename)
+	for i in numpy.argsort(times,kind='mergesort'):
+		f.write('%s\n' % '\t'.join(records[i]))
+	f.close()
+	return
 
-	# Now write the time sorted file
-	xstart=time.time()
-	write_ordered_list(fileroot,time_sorted)
-	write_time=time.time()-xstart
-	print '# Time to write the .ls file  %s s' % write_time
+def read_run(run):
+	'''
+	Generate the records of a sorted run, which is either a list of 
+	records or the name of a file written by write_run
 
-	print '# Completed creating %s.ls' % (fileroot)
+	History:
 
-	print '# make_ordered_list: times',search_time,key_time,sort_time,write_time
+	261018	Coded
+	'''
+
+	if not isinstance(run,str):
+		for record in run:
+			yield record
+		return
+
+	f=open(run,'r')
+	for line in f:
+		yield line.rstrip('\n').split('\t')
+	f.close()
+
+def keyed_run(run,irun):
+	'''
+	Generate (expstart,irun,position,record) for each record in a 
+	sorted run, which is what is needed to merge the runs with heapq
+
+	History:
+
+	261018	Coded
+	'''
+
+	j=0
+	for record in read_run(run):
+		yield (float(record[6]),irun,j,record)
+		j=j+1
 
-	return time_sorted
+def merge_runs(runs):
+	'''
+	Generate (expstart,irun,position,record) for all of the records in
+	a list of runs, each of which is in time order, in time order.  
+	Where the times are the same, records from earlier runs come first.
+	Only one record from each run is held in memory at a time.
+
+	History:
+
+	261018	Coded, replacing merge_ordered_lists
+	'''
+
+	sources=[]
+	irun=0
+	while irun<len(runs):
+		sources.append(keyed_run(runs[irun],irun))
+		irun=irun+1
+
+	return heapq.merge(*sources)
+
+def manifest_entries(runs):
+	'''
+	Generate the [filename,record] for each of the records in a list of
+	runs, for write_manifest
+
+	History:
+
+	261018	Coded
+	'''
+
+	for run in runs:
+		for record in read_run(run):
+			yield [record[0],record]
+
+def read_manifest(fileroot='observations'):
+	'''
+	Read the manifest written by the last run of make_ordered_list, which
+	records the size and modification time of each file that was inspected
+	and what was found in it.
+
+	The manifest is a tab-separated file, fileroot.manifest, with one line
+	for each file containing
+
+	filename	size	mtime	record
+
+	where the record contains the words of the record in the .ls file, or 
+	'skip' if the file does not belong in the .ls file
+
+	The routine returns a dictionary, indexed by the file name, containing 
+	[size,mtime,record] where the record is an empty list for skipped files.
+	If there is no manifest, the dictionary is empty, and all of the files
+	will be inspected.
+
+	History:
+
+	261018	Coded
+	'''
+
+	manifest={}
+	try:
+		f=open(fileroot+'.manifest','r')
+		lines=f.readlines()
+		f.close()
+	except IOError:
+		print 'read_manifest: There is no manifest %s, so all files will be inspected' % (fileroot+'.manifest')
+		return manifest
+
+	for line in lines:
+		if line[0]=='#':
+			continue
+		words=line.rstrip('\n').split('\t')
+		if len(words)<4:
+			continue
+		try:
+			size=int(words[1])
+			mtime=float(words[2])
+		except ValueError:
+			continue
+		if words[3]=='skip':
+			record=[]
+		else:
+			record=words[3:]
+		manifest[words[0]]=[size,mtime,record]
+	return manifest
+
+def write_manifest(fileroot,entries,stamps):
+	'''
+	Write the manifest for make_ordered_list, given a list (or a generator) of
+	[filename,record] and a dictionary stamps containing the [size,mtime]
+	for each of the files.  See read_manifest for the format.
+
+	History:
+
+	261018	Coded
+	'''
+
+	filename=fileroot+'.manifest'
+	tmpfile='%s.%d.tmp' % (filename,os.getpid())
+
+	f=open_file(tmpfile)
+	f.write('# Manifest of the files inspected by per_list.make_ordered_list\n')
+	for one in entries:
+		if one[0] not in stamps:
+			continue
+		size,mtime=stamps[one[0]]
+		if len(one[1])==0:
+			xstring='skip'
+		else:
+			xstring='\t'.join(one[1])
+		f.write('%s\t%d\t%r\t%s\n' % (one[0],size,mtime,xstring))
+	f.close()
+	os.rename(tmpfile,filename)
+	return
 	
-def write_ordered_list(fileroot='observations',records=[]):
+def write_ordered_list(fileroot='observations',records=[],report='no'):
 	'''
-	Write the ordered_list file from a set of records
+	Write the ordered_list file from a set of records.  If report is 'yes'
+	the records which are superseded by other versions of the same dataset
+	are listed (see check4duplicates)
 
 	110104	ksl	Split from make_ordered list in order to ease the creation of sublists
+	261018		Discard any ObservationCatalog for the file
+	261018		Also write the binary version of the file, fileroot.ls.npy
+	261018		Split the writing of the file into write_records, which is shared
+			with write_ordered_runs
+	261018		Added report
+	'''
+
+	# Note that the duplication check here is awkward, but we want to
+	# keep track of duplicate records in the output file
+	ok=check4duplicates(records,report)
+
+	write_records(fileroot,itertools.izip(records,ok))
+	return
+
+def write_ordered_runs(fileroot,runs):
+	'''
+	Write the ordered_list file by merging a list of runs, each of which is a 
+	list of records, or the name of a file written by write_run, in time order.  
+	This is what make_ordered_list uses, so that the records do not all have to 
+	be in memory at once.
+
+	The routine returns the number of records, and if there are none, the
+	file is not written.
+
+	Notes:
+
+	The duplicate datasets are resolved as in check4duplicates, the version
+	which was created last being the one that is used, and when the creation 
+	dates are the same, the one that comes last in the file.  To do this without 
+	holding all of the records, the runs are read once to find the best version
+	of each dataset, and then again as they are merged.
+
+	History:
+
+	261018	Coded
+	'''
+
+	xstart=time.time()
+
+	# The best version of each dataset so far, as (creation date,expstart,irun,position)
+	best={}
+	nrecords=0
+	irun=0
+	while irun<len(runs):
+		j=0
+		for record in read_run(runs[irun]):
+			key=(record[17],float(record[6]),irun,j)
+			one=best.get(record[1])
+			if one==None or key>=one:
+				best[record[1]]=key
+			j=j+1
+		nrecords=nrecords+j
+		irun=irun+1
+
+	if nrecords==0:
+		return 0
+
+	if len(best)==nrecords:
+		print 'check4duplicates: There are no duplicates in the directory structure'
+	else:
+		print 'check4duplicates: Warning: There are %d duplicate datasets in the directory structure' % (nrecords-len(best))
+	print 'Check for duplicates in direcory structure took:',time.time()-xstart
+
+	write_records(fileroot,flag_duplicates(merge_runs(runs),best))
+	return nrecords
+
+def flag_duplicates(merged,best):
+	'''
+	Generate [record,ok] for each of the records from merge_runs, where ok is 'ok' 
+	for the version of a dataset in best, and 'nok' for any other
+
+	History:
+
+	261018	Coded
+	'''
+
+	for xtime,irun,j,record in merged:
+		if best[record[1]]==(record[17],xtime,irun,j):
+			yield [record,'ok']
+		else:
+			yield [record,'nok']
+
+def write_records(fileroot,records):
+	'''
+	Write the .ls file, and its binary version, one record at a time
+	from an iterable of [record,ok], where ok is 'nok' for records which 
+	are to be commented out
+
+	History:
+
+	261018	Split from write_ordered_list
 	'''
 
 	# Now write it all to an ascii file
@@ -1177,16 +1806,13 @@ def write_ordered_list(fileroot='observations',records=[]):
 
 	f=open_file(fileroot+'.ls')
 
-	# Note that the duplication check here is awkward, but we want to
-	# keep track of duplicate records in the output file
-	ok=check4duplicates(records)
+	# Make sure the file is read again the next time it is needed
+	if fileroot in catalogs:
+		del catalogs[fileroot]
 
 	# Now write out each record one by one
-	i=0
-	while i<len(records):
-		record=records[i]
-		# print 'xxx',record
-		if ok[i]=='ok':
+	for record,ok in records:
+		if ok=='ok':
 			xstring='%-50s ' % record[0]  # File name
 		else:
 			xstring='# %-48s ' % record[0]  # File name
@@ -1216,37 +1842,352 @@ def write_ordered_list(fileroot='observations',records=[]):
 		xstring=xstring+'%-5s ' % record[16] # PI      
 		xstring=xstring+'%-5s ' % record[17] # File creation date
 		f.write('%-5s\n' % xstring)
-		i=i+1
 	f.close()
+
+	write_catalog_table(fileroot)
 	return
 
 	
 
+# This is the section which holds the .ls files that have been read, so that each file is
+# only parsed once in a process, no matter how many times it is queried.
+#
+# write_ordered_list also writes a binary version of the .ls file, fileroot.ls.npy, which
+# is a numpy structured array with the fields in catalog_dtype.  It is given the same
+# modification time as the .ls file, and is only used if the two times still agree, so
+# the .ls file remains the definitive version.
+
+catalogs={}
+
+def catalog_dtype(linelength=256,namelength=16):
+	'''
+	Return the numpy dtype of the table which holds an ObservationCatalog,
+	where linelength and namelength are the lengths of the longest line
+	and dataset name
+
+	History:
+
+	261018	Coded
+	'''
+	return numpy.dtype([('line','S%d' % max(linelength,1)),('mjd','f8'),('name','S%d' % max(namelength,1)),('prog','i4')])
+
+def catalog_row(line):
+	'''
+	Return the dataset name, program id and expstart for one line of an 
+	.ls file.  A program id which is not a number is returned as -1, and 
+	an expstart which is not a number as nan.
+
+	History:
+
+	261018	Split from make_catalog_table
+	'''
+
+	words=line.split()
+
+	if len(words)>1:
+		name=words[1]
+	else:
+		name=''
+
+	try:
+		prog=min(max(int(words[2]),-1),2**31-1)
+	except (ValueError,IndexError,OverflowError):
+		prog=-1
+
+	try:
+		mjd=float(words[6])
+	except (ValueError,IndexError):
+		mjd=numpy.nan
+
+	return name,prog,mjd
+
+def make_catalog_table(lines):
+	'''
+	Convert the lines (the records which are not commented out) of an 
+	.ls file to a table for an ObservationCatalog.  See catalog_row
+	for how the lines are parsed.
+
+	History:
+
+	261018	Coded
+	261018	Use catalog_row
+	'''
+
+	rows=[]
+	maxlen=0
+	namelen=0
+	for line in lines:
+		rows.append(catalog_row(line))
+		maxlen=max(maxlen,len(line))
+		namelen=max(namelen,len(rows[-1][0]))
+
+	table=numpy.zeros(len(lines),dtype=catalog_dtype(maxlen,namelen))
+	i=0
+	while i<len(lines):
+		table[i]=(lines[i],rows[i][2],rows[i][0],rows[i][1])
+		i=i+1
+
+	return table
+
+def write_catalog_table(fileroot):
+	'''
+	Write the binary version of fileroot.ls, which must already have
+	been written, and give it the modification time of the .ls file.
+
+	The .ls file is read twice, first to find the size of the table, and
+	then to fill it, so that the records do not all have to be held
+	in memory.
+
+	History:
+
+	261018	Coded
+	261018	Read the records from the .ls file, and write them to a memory
+		mapped array, rather than being given all of the lines
+	'''
+
+	filename=fileroot+'.ls'
+	sidecar=filename+'.npy'
+	tmpfile='%s.%d.tmp.npy' % (filename,os.getpid())
+
+	try:
+		nlines=0
+		maxlen=0
+		namelen=0
+		f=open(filename,'r')
+		for line in f:
+			line=line.strip()
+			if len(line)>0 and line[0]!='#':
+				nlines=nlines+1
+				maxlen=max(maxlen,len(line))
+				namelen=max(namelen,len(catalog_row(line)[0]))
+		f.close()
+
+		table=open_memmap(tmpfile,mode='w+',dtype=catalog_dtype(maxlen,namelen),shape=(nlines,))
+		i=0
+		f=open(filename,'r')
+		for line in f:
+			line=line.strip()
+			if len(line)>0 and line[0]!='#' and i<nlines:
+				name,prog,mjd=catalog_row(line)
+				table[i]=(line,mjd,name,prog)
+				i=i+1
+		f.close()
+		table.flush()
+		del table
+
+		os.chmod(tmpfile,0770)
+		os.rename(tmpfile,sidecar)
+		stat=os.stat(filename)
+		os.utime(sidecar,(stat.st_atime,stat.st_mtime))
+	except (IOError,OSError,ValueError):
+		print 'Warning: write_catalog_table: Could not write %s' % sidecar
+		if os.path.exists(tmpfile):
+			os.remove(tmpfile)
+	return
+
+def read_catalog_table(fileroot):
+	'''
+	Return the binary version of fileroot.ls, memory mapped, if it exists
+	and has the same modification time as the .ls file, or None otherwise
+
+	History:
+
+	261018	Coded
+	'''
+
+	filename=fileroot+'.ls'
+	sidecar=filename+'.npy'
+
+	try:
+		if abs(os.path.getmtime(sidecar)-os.path.getmtime(filename))>1e-5:
+			return None
+		table=numpy.load(sidecar,mmap_mode='r')
+	except (IOError,OSError,ValueError):
+		return None
+
+	if table.dtype.names!=catalog_dtype().names:
+		return None
+	return table
+
+class ObservationCatalog(object):
+	'''
+	The records of an .ls file, as written by write_ordered_list, held
+	so that they can be queried without reading the file again.
+
+	fileroot	the root name of the .ls file
+	stamp		the modification time and size of the file when it was read, 
+			or None if the file could not be read
+	table		a structured array with the line, the expstart (MJD), the dataset 
+			name and the program id of each of the records which are not 
+			commented out.   This comes from the binary version of the 
+			file if it is up to date, or is made from the .ls file
+	times		the expstart of each record, from table
+	time_ordered	True if the records are in time order, which is needed for the
+			searches.  If False, the read_ordered_list routines fall back
+			to reading through all of the records.
+
+	Notes:
+
+	Use get_catalog to obtain the catalog for a file, which rereads the
+	file if it has changed.
+
+	Records are only split into words when they are requested.  The 
+	index of dataset names is made the first time it is needed.
+
+	History:
+
+	261018	Coded
+	261018	The records are kept in a table, which is read from the binary
+		version of the .ls file if possible
+	'''
+
+	def __init__(self,fileroot='observations'):
+		self.fileroot=fileroot
+		self.stamp=None
+		self.table=make_catalog_table([])
+		self.times=self.table['mjd']
+		self.rows=None
+		self.time_ordered=True
+
+		filename=fileroot+'.ls'
+		try:
+			stat=os.stat(filename)
+		except OSError:
+			print 'Error: read_ordered_list0: Could not open %s ' % (filename)
+			return
+
+		table=read_catalog_table(fileroot)
+		if table is None:
+			try:
+				f=open(filename,'r')
+				lines=f.readlines()
+				f.close()
+			except IOError:
+				print 'Error: read_ordered_list0: Could not open %s ' % (filename)
+				return
+
+			records=[]
+			for line in lines:
+				line=line.strip()
+				if len(line)>0 and line[0]!='#':
+					records.append(line)
+			table=make_catalog_table(records)
+
+		self.stamp=(stat.st_mtime,stat.st_size)
+		self.table=table
+		self.times=table['mjd']
+
+		if numpy.any(numpy.isnan(self.times)):
+			self.time_ordered=False
+		elif len(self.times)>1 and numpy.all(self.times[1:]>=self.times[:-1])==False:
+			self.time_ordered=False
+
+	def is_current(self):
+		'''
+		Return True if the .ls file has not changed since it was read
+		'''
+
+		try:
+			stat=os.stat(self.fileroot+'.ls')
+		except OSError:
+			return False
+		return self.stamp==(stat.st_mtime,stat.st_size)
+
+	def find(self,dataset):
+		'''
+		Return the index of the (first) record for a dataset, or -1 if 
+		it is not in the catalog
+		'''
+
+		if self.rows is None:
+			names,first=numpy.unique(self.table['name'],return_index=True)
+			self.rows=dict(zip(names.tolist(),first.tolist()))
+
+		return self.rows.get(dataset,-1)
+
+	def find_prog(self,prog_id):
+		'''
+		Return the indices of the records for a program id
+		'''
+
+		return numpy.nonzero(self.table['prog']==int(prog_id))[0].tolist()
+
+	def first(self,test,guess=0):
+		'''
+		Return the index of the first record whose time satisfies test, where
+		test must be False for early times and True for later ones, so
+		the records must be time ordered.  guess, typically from 
+		numpy.searchsorted, is the place to start looking.  
+
+		This allows the searches to give exactly the same answers as the
+		comparisons made in the original versions of the read_ordered_list
+		routines, which read through the records one by one.
+		'''
+
+		n=len(self.times)
+		i=min(max(guess,0),n)
+		while i>0 and test(self.times[i-1]):
+			i=i-1
+		while i<n and test(self.times[i])==False:
+			i=i+1
+		return i
+
+	def get_record(self,i):
+		'''
+		Return record i as a list of words, as it would have been read 
+		from the file
+		'''
+
+		return self.table['line'][i].split()
+
+	def get_records(self,ifirst=0,ilast=None):
+		'''
+		Return records ifirst to ilast (exclusive) as lists of words
+		'''
+
+		records=[]
+		for line in self.table['line'][ifirst:ilast]:
+			records.append(line.split())
+		return records
+
+	def get_records_by_index(self,rows):
+		'''
+		Return the records with the indices in rows as lists of words
+		'''
+
+		records=[]
+		for i in rows:
+			records.append(self.table['line'][i].split())
+		return records
+
+def get_catalog(fileroot='observations'):
+	'''
+	Return the ObservationCatalog for the fileroot+'.ls', reading the
+	file only if it has not been read before or has changed.
+
+	History:
+
+	261018	Coded
+	'''
+
+	cat=catalogs.get(fileroot)
+	if cat==None or cat.is_current()==False:
+		cat=ObservationCatalog(fileroot)
+		if cat.stamp!=None:
+			catalogs[fileroot]=cat
+	return cat
+
 def read_ordered_list0(fileroot='observations'):
 	'''
 	This simply reads the list and returns all of the records
 
 	Eventually should replace what is in read_ordered_list and
 	read_ordered_list2
-	'''
 
-	# Read the entire file
-	records=[]
-	times=[]
-	try:
-		f=open(fileroot+'.ls','r')
-		lines=f.readlines()
-		f.close
-	except IOError:
-		print 'Error: read_ordered_list0: Could not open %s ' % (fileroot+'.ls')
-		return []
+	261018		The records now come from the ObservationCatalog for the file
+	'''
 
-	for line in lines:
-		line=line.strip()
-		words=line.split()
-		if words[0][0]!='#':
-			records.append(words)
-	return(records)
+	return get_catalog(fileroot).get_records()
 
 
 def read_ordered_list2(fileroot='observations',dataset='first',interval=[-1,2],outroot='none'):
@@ -1258,57 +2199,49 @@ def read_ordered_list2(fileroot='observations',dataset='first',interval=[-1,2],o
 	a file called outroot+.ls
 
 	111019	ksl	Removed lines which read entire file, and replaced with call to read_ordered_list0
+	261018		Use the ObservationCatalog to locate the dataset and the records
+			in the interval without reading through the entire list
 	'''
 
-	# Read the entire file
-	records=read_ordered_list0(fileroot)
+	cat=get_catalog(fileroot)
 
 	# Check the dataset name
 	dataset=parse_dataset_name(dataset)
 
 	# print 'Looking for ',dataset
 	# locate the record with a given dataset name
-	izero=0
-	while izero< len(records):
-		record=records[izero]
-		# print record[1],dataset
-		if dataset==record[1]:
-			# print 'Found %s at record %d' % (dataset,izero)
-			break
-		izero=izero+1
-
-	if izero==len(records):
+	izero=cat.find(dataset)
+
+	if izero<0:
 		print 'Error: read_ordered_list2: Could not locate record for dataset %s in %s.ls' % (dataset,fileroot)
 		# print 'Using first record'
 		# izero=0
 		# Changed this return 101215 to trap datasets that are not in observations.ls
 		return []
 
-	zero_time=eval(records[izero][6])
+	zero_time=cat.times[izero]
 
 	# locate the datasets within the interval
 	istart=-1
 	istop=-1
-	i=0
-	times=[]
-	while i<len(records):
-		time=eval(records[i][6])
-		dt=(time-zero_time)*24  # convert MJD to hours
-		if dt >= interval[0] and istart == -1:
+	if cat.time_ordered:
+		i=cat.first(lambda time: (time-zero_time)*24 >= interval[0],numpy.searchsorted(cat.times,zero_time+interval[0]/24.))
+		if i<len(cat.times):
 			istart=i
-		if istart!=-1 and dt <= interval[1]:
-			times.append(dt)
-			istop=i
-		i=i+1
-
-	# print 'Check lengths: ',len(times),len(records[istart:istop+1])
-
-	xxx=records[istart:istop+1]
-	i=0
-	while i<len(times):
-		# print '%10.1f %50s %10s %10s %10s' % (times[i],xxx[i][0],xxx[i][7],xxx[i][8],xxx[i][12])
-		i=i+1
+			i=cat.first(lambda time: (time-zero_time)*24 > interval[1],numpy.searchsorted(cat.times,zero_time+interval[1]/24.,'right'))
+			if i-1>=istart:
+				istop=i-1
+	else:
+		i=0
+		while i<len(cat.times):
+			dt=(cat.times[i]-zero_time)*24  # convert MJD to hours
+			if dt >= interval[0] and istart == -1:
+				istart=i
+			if istart!=-1 and dt <= interval[1]:
+				istop=i
+			i=i+1
 
+	xxx=cat.get_records(istart,istop+1)
 
 	# Now write it all to an ascii file
 	if outroot!='none' and outroot != fileroot:
@@ -1326,7 +2259,7 @@ def read_ordered_list2(fileroot='observations',dataset='first',interval=[-1,2],o
 
 		f.close()
 
-	return records[istart:istop+1]
+	return xxx
 
 
 def read_ordered_list(fileroot='observations',dataset='last',delta_time=24):
@@ -1347,47 +2280,50 @@ def read_ordered_list(fileroot='observations',dataset='last',delta_time=24):
 	110121	ksl	Modified so that returns empty array if a dataset is request
 			which does not exist 
 	111019	ksl	Replaced the section that reads the entire file
+	261018		Use the ObservationCatalog to locate the dataset and the records
+			in the interval without reading through the entire list
 	'''
 
-	# Read the entire file
-	records=read_ordered_list0(fileroot)
+	cat=get_catalog(fileroot)
 
 	if dataset!='last':
 		# locate the record with a given dataset name
-		ilast=0
-		while ilast< len(records):
-			record=records[ilast]
-			if dataset==record[1]:
-				# print 'Found %s at record %d' % (dataset,ilast)
-				break
-			ilast=ilast+1
+		ilast=cat.find(dataset)
 
-		if ilast==len(records):
+		if ilast<0:
 			print 'Error: read_ordered_list: Did not find dataset %s, returning' % dataset
 			return []
 
-		end_time=eval(records[ilast][6])
 	else:  # Use the last record as the endpoint
-		# end_time=eval(records[len(records)-1][8])
-		end_time=eval(records[len(records)-1][6])
-		ilast=len(records) - 1
+		ilast=len(cat.times) - 1
+		if ilast<0:
+			return []
+
+	end_time=cat.times[ilast]
 
 	# print 'End time', end_time
 	if delta_time>0:
 		delta_time=delta_time/24.
-		# Locate the first record we want
-		ifirst=0
-		# dt=end_time-eval(records[ifirst][8])
-		dt=end_time-eval(records[ifirst][6])
-		while dt > delta_time and ifirst < ilast:
-			# dt=end_time-eval(records[ifirst][8])
-			dt=end_time-eval(records[ifirst][6])
-			ifirst=ifirst+1
+		# Locate the first record we want. Note that the first record 
+		# within delta_time is itself returned only if it is the first
+		# record in the file, as has always been the case
+		if cat.time_ordered:
+			k=cat.first(lambda time: end_time-time <= delta_time,numpy.searchsorted(cat.times,end_time-delta_time))
+			if k==0:
+				ifirst=0
+			else:
+				ifirst=min(k+1,ilast)
+		else:
+			ifirst=0
+			dt=end_time-cat.times[ifirst]
+			while dt > delta_time and ifirst < ilast:
+				dt=end_time-cat.times[ifirst]
+				ifirst=ifirst+1
 		# print 'Returning %d to %d ' % (ifirst,ilast)x
 
-		return records[ifirst:ilast+1]
+		return cat.get_records(ifirst,ilast+1)
 	else:
-		return records[ilast]
+		return cat.get_record(ilast)
 
 
 
@@ -1400,30 +2336,35 @@ def read_ordered_list_mjd(fileroot,mjd_start=0,mjd_stop=0):
 	if mjd_stop=0,  continue to the end of the list
 
 	101109	ksl	Coded and debugged
+	261018		Use the ObservationCatalog to find the records
 	'''
 
-	records=read_ordered_list0(fileroot)
-	records_out=[]
-	nrec=len(records)
+	cat=get_catalog(fileroot)
+	nrec=len(cat.times)
 
 	print 'The total number of records is ',nrec
 
 	i=0
 	if mjd_start>0:
-		while i < nrec and mjd_start > eval(records[i][6]):
-			i=i+1
+		if cat.time_ordered:
+			i=numpy.searchsorted(cat.times,mjd_start)
+		else:
+			while i < nrec and mjd_start > cat.times[i]:
+				i=i+1
 	ifirst=i
 
 	if mjd_stop==0:
 		ilast=nrec
+	elif cat.time_ordered:
+		ilast=max(ifirst,numpy.searchsorted(cat.times,mjd_stop,'right'))
 	else:
-		while i<nrec and mjd_stop >= eval(records[i][6]):
+		while i<nrec and mjd_stop >= cat.times[i]:
 			i=i+1
 		ilast=i
 
 	print 'Retrieving %d records from %d to %d ' % (ilast-ifirst,ifirst,ilast)
 	
-	return records[ifirst:ilast]
+	return cat.get_records(ifirst,ilast)
 
 def read_ordered_list_progid(fileroot='observations',prog_id=11216,mjd_start=0,mjd_stop=0):
 	'''
@@ -1435,39 +2376,33 @@ def read_ordered_list_progid(fileroot='observations',prog_id=11216,mjd_start=0,m
 
 	111019	ksl	Modified so that if prog_id is 0 or less then everything is returned
 			In this case the routine behaves exactly like red_ordered_list_mjd
+	261018		Use the program id index of the ObservationCatalog
 	'''
 
-	records=read_ordered_list0(fileroot)
-	records_out=[]
-	nrec=len(records)
-
+	cat=get_catalog(fileroot)
 
 	if prog_id<=0:
-		xrec=records
+		rows=range(len(cat.times))
 	else:
-		xrec=[]
-		for record in records:
-			if int(record[2])==int(prog_id):
-				xrec.append(record)
+		rows=cat.find_prog(prog_id)
 	
-	if len(xrec)==0:
+	if len(rows)==0:
 		print 'No records from prog_id %d found in %s.ls' % (prog_id,fileroot)
 		return []
 
 	if mjd_start==0 and mjd_stop==0:
-		return xrec
+		return cat.get_records_by_index(rows)
 
-	zrec=[]
-	for record in xrec:
-		xtime=eval(record[6])
-		# print xtime
+	zrows=[]
+	for i in rows:
+		xtime=cat.times[i]
 		if mjd_start<=xtime and xtime <= mjd_stop:
-			zrec.append(record)
+			zrows.append(i)
 	
-	if len(zrec)==0:
-		print 'Although %d were found for prog_id %d, none between mjd %e and %e' % (len(xrec),prog_id,mjd_start,mjd_stop)
+	if len(zrows)==0:
+		print 'Although %d were found for prog_id %d, none between mjd %e and %e' % (len(rows),prog_id,mjd_start,mjd_stop)
 	
-	return zrec
+	return cat.get_records_by_index(zrows)
 
 
 
@@ -1497,6 +2432,11 @@ def steer(argv):
 	120330	ksl	Added a fix so make_sum_file would receive
 			a rootname that it could use in instances
 			where the ftype was not flt
+	261018		-daily now only inspects files which are new or
+			have changed since the last run
+	261018		Added -io_threads
+	261018		Added -walk_threads
+	261018		Added -sum_db and -export_sum
 
 	'''
 
@@ -1506,6 +2446,11 @@ def steer(argv):
 	new_summary_file='no'
 	root='observations'
 	np=1
+	incremental='no'
+	io_threads=1
+	walk_threads=1
+	sum_db='no'
+	export_sum='no'
 
 
 	i=1
@@ -1524,12 +2469,23 @@ def steer(argv):
 		elif argv[i]=='-daily':  # This is the standard switch crontab generation
 			new_ls_file='yes'
 			new_summary_file='no'
+			incremental='yes'
 		elif argv[i]=='-file_type':
 			i=i+1
 			ftype=argv[i]
 		elif argv[i]=='-np':
 			i=i+1
 			np=int(argv[i]) 
+		elif argv[i]=='-io_threads':
+			i=i+1
+			io_threads=int(argv[i])
+		elif argv[i]=='-walk_threads':
+			i=i+1
+			walk_threads=int(argv[i])
+		elif argv[i]=='-sum_db':
+			sum_db='yes'
+		elif argv[i]=='-export_sum':
+			export_sum='yes'
 		else:
 			if i != len(argv)-1:
 				print 'Could not understand argument %d :%s' % (i,argv[i])
@@ -1540,8 +2496,12 @@ def steer(argv):
 
 	# At this point we have fully parsed the observation list
 
+	if export_sum=='yes':
+		export_summary(root)
+		return
+
 	xstart=time.time()
-	make_ordered_list(root,aperture,ftype,new_ls_file,np)
+	make_ordered_list(root,aperture,ftype,new_ls_file,np,incremental,io_threads,walk_threads)
 	dtime=time.time()-xstart
 	print '# Time to make the .ls file: ',dtime
 
@@ -1553,6 +2513,8 @@ def steer(argv):
 
 	dtime=time.time()-xstart
 	make_sum_file(root,new_summary_file)
+	if sum_db=='yes' and summary_db(root)==None:
+		make_summary_db(root)
 	dtime=time.time()-xstart
 	print '# Time to make the .sum file: ',dtime
 
@@ -0,0 +1,347 @@
+#! /usr/bin/env python
+
+'''
+                    Space Telescope Science Institute
+
+Synopsis:
+
+	Routines to read the summary file, usually observations.sum, which
+	records the persistence processing of each dataset, and to select
+	records from it
+
+
+Command line usage (if any):
+
+	usage: per_sum.py [-status xxx] [-prog_id xxxx] [fileroot]
+
+	prints the records in the summary file which are selected
+
+Description:
+
+	The summary file is read once, and the information used to select records,
+	that is the status, the program id, the MJD of the observation and the time
+	at which the dataset was processed, is held in numpy arrays so that the
+	selections can be made for all of the records at once.  The file is only
+	read again if it changes.
+
+Primary routines:
+
+	read_sum_file	Return the records which meet various criteria.  This is
+			the routine which was in subtract_sum and make_tar
+	get_summary	Return the SummaryTable for a file
+
+Notes:
+
+	The selections are made in the same way as by the earlier versions of
+	read_sum_file in subtract_sum and make_tar.  In particular the status
+	selects all records whose status contains the string that is given, and
+	the processing time is only used if proc_stop is given.
+
+History:
+
+261018	Coded, replacing the versions of read_sum_file in subtract_sum and
+	make_tar
+
+'''
+
+import sys
+import os
+import numpy
+import date
+
+
+class SummaryTable(object):
+	'''
+	The records of a summary file, held so that they can be selected
+	without reading the file again.
+
+	fileroot	the root name of the summary file
+	stamp		the modification time and size of the file when it was read,
+			or None if the file could not be read
+	words		the words of each record which is not commented out
+	dataset		the dataset names
+	prog		the program ids, as integers, or -1 if the program id is not a number
+	mjd		the MJD of the observations, or nan if the MJD is not a number
+	status		the status words
+	proc_time	the time at which each dataset was processed, in seconds
+			since Epoch0 (see date.parse_iso), which is calculated
+			the first time it is needed
+
+	Notes:
+
+	Use get_summary to obtain the table for a file, which rereads the file
+	if it has changed.
+
+	History:
+
+	261018	Coded
+	'''
+
+	def __init__(self,fileroot='observations'):
+		self.fileroot=fileroot
+		self.stamp=None
+		self.words=[]
+		self.proc_time=None
+
+		dataset=[]
+		prog=[]
+		mjd=[]
+		status=[]
+
+		filename=fileroot+'.sum'
+		try:
+			stat=os.stat(filename)
+			f=open(filename,'r')
+			for line in f:
+				z=line.split()
+				if len(z)==0 or z[0][0]=='#':
+					continue
+				self.words.append(z)
+				dataset.append(z[0])
+
+				try:
+					prog.append(int(z[1]))
+				except (ValueError,IndexError,OverflowError):
+					prog.append(-1)
+
+				try:
+					mjd.append(float(z[2]))
+				except (ValueError,IndexError):
+					mjd.append(numpy.nan)
+
+				if len(z)>5:
+					status.append(z[5])
+				else:
+					status.append('')
+			f.close()
+			self.stamp=(stat.st_mtime,stat.st_size)
+		except (IOError,OSError):
+			print "The file %s does not exist" % filename
+
+		self.dataset=numpy.array(dataset,dtype='S')
+		self.prog=numpy.array(prog,dtype=numpy.int64)
+		self.mjd=numpy.array(mjd,dtype=numpy.float64)
+		self.status=numpy.array(status,dtype='S')
+
+	def is_current(self):
+		'''
+		Return True if the summary file has not changed since it was read
+		'''
+
+		try:
+			stat=os.stat(self.fileroot+'.sum')
+		except OSError:
+			return False
+		return self.stamp==(stat.st_mtime,stat.st_size)
+
+	def get_proc_time(self):
+		'''
+		Return the times at which the datasets were processed in seconds
+		since Epoch0, as date.parse_iso would, or nan if a time cannot
+		be parsed.
+		'''
+
+		if self.proc_time is not None:
+			return self.proc_time
+
+		xtimes=[]
+		for z in self.words:
+			if len(z)>4:
+				xtimes.append('%sT%s' % (z[3],z[4]))
+			else:
+				xtimes.append('')
+
+		try:
+			proc_time=numpy.array(xtimes,dtype='datetime64[s]')
+			proc_time=(proc_time-numpy.datetime64(0,'s')).astype(numpy.float64)
+		except ValueError:
+			# At least one of the times is not in the standard form, so parse them one by one
+			proc_time=numpy.zeros(len(self.words))
+			i=0
+			while i<len(self.words):
+				z=self.words[i]
+				try:
+					proc_time[i]=date.parse_iso('%s %s' % (z[3],z[4]))
+				except (ValueError,IndexError):
+					proc_time[i]=numpy.nan
+				i=i+1
+
+		# Records without a time would otherwise have been given the time NaT
+		if len(self.words)>0:
+			proc_time[numpy.array(xtimes)=='']=numpy.nan
+
+		self.proc_time=proc_time
+		return proc_time
+
+	def select_rows(self,status='Complete',prog_id=0,mjd_start=0,mjd_stop=0,proc_start=0,proc_stop=0):
+		'''
+		Return the indices of the records which meet the criteria of read_sum_file
+		'''
+
+		ok=numpy.ones(len(self.words),dtype=bool)
+
+		if status!='All':
+			ok&=numpy.char.count(self.status,status)>0
+
+		if prog_id != 0:
+			ok&=self.prog==int(prog_id)
+
+		# 130103 - Added to fix bug where start time is provided but no end time
+		if mjd_start>0 and mjd_stop==0:
+			mjd_stop=mjd_start+1e6  # A large number
+
+		if mjd_stop > 0 and mjd_start <  mjd_stop:
+			ok&=(mjd_start<=self.mjd)&(self.mjd<=mjd_stop)
+
+		# Convert proc start and stop time to seconds
+		if proc_start!=0:
+			try:
+				proc_start=float(proc_start)
+			except ValueError:
+				proc_start=date.parse_iso(proc_start)
+
+		if proc_stop!=0:
+			try:
+				proc_stop =float(proc_stop )
+			except ValueError:
+				proc_stop =date.parse_iso(proc_stop )
+
+		if proc_stop != 0 or proc_start <  proc_stop:
+			proc_time=self.get_proc_time()
+			ok&=(proc_start<=proc_time)&(proc_time<=proc_stop)
+
+		return numpy.nonzero(ok)[0]
+
+	def get_records(self,rows):
+		'''
+		Return the words of the records with the indices in rows
+		'''
+
+		records=[]
+		for i in rows:
+			records.append(list(self.words[i]))
+		return records
+
+	def select(self,status='Complete',prog_id=0,mjd_start=0,mjd_stop=0,proc_start=0,proc_stop=0):
+		'''
+		Return the words of the records which meet the criteria of read_sum_file
+		'''
+
+		return self.get_records(self.select_rows(status,prog_id,mjd_start,mjd_stop,proc_start,proc_stop))
+
+	def group_by_prog(self,rows=None):
+		'''
+		Return a dictionary containing the indices of the records for
+		each program id, in the order of the file.  If rows is given, only
+		those records are included.
+		'''
+
+		if rows is None:
+			rows=numpy.arange(len(self.words))
+		rows=numpy.asarray(rows)
+
+		groups={}
+		if len(rows)==0:
+			return groups
+
+		# A stable sort keeps the records of each program in the order of the file
+		order=rows[numpy.argsort(self.prog[rows],kind='mergesort')]
+		progs=self.prog[order]
+		edges=numpy.nonzero(progs[1:]!=progs[:-1])[0]+1
+		starts=numpy.concatenate(([0],edges))
+		stops=numpy.concatenate((edges,[len(order)]))
+		i=0
+		while i<len(starts):
+			groups[int(progs[starts[i]])]=order[starts[i]:stops[i]]
+			i=i+1
+		return groups
+
+
+# This holds the summary files that have been read, so each file is only read
+# again if it changes
+
+summaries={}
+
+def get_summary(fileroot='observations'):
+	'''
+	Return the SummaryTable for fileroot.sum, reading the file only if
+	it has not been read already, or if it has changed
+
+	History:
+
+	261018	Coded
+	'''
+
+	table=summaries.get(fileroot)
+	if table==None or table.is_current()==False:
+		table=SummaryTable(fileroot)
+		summaries[fileroot]=table
+	return table
+
+
+def read_sum_file(fileroot='observations',status='Complete',prog_id=0,mjd_start=0,mjd_stop=0,proc_start=0,proc_stop=0):
+	'''
+	Read the summary file and return selected sets of records in the observations.sum with the selection determined by
+
+	status		a string which must be part of the status of the record, or 'All'
+	prog_id		program_id (a single number)
+	mjd_start       datasets taken after mjd_start
+	mjd_stop	datasets taken before mjd_stop
+	proc_start	datasets processed after proc_start
+	proc_stop       datasets processed before proc_stop
+
+	In general, if a value is 0, it is not used in selecting the data set
+
+	The records are returned as lists of words.
+
+	111011	ksl	Modified the way the routine works so that to select something on the basis of status,
+			one just needs to include the string that is in status.  This is to accommodate versioning.
+			NOTE -- It is not obvious that one should check for status at all, since one usually wants
+			to see what happened to a serios of files. What is more relevebant is the program ID or
+			whether one attempted to process it in a certain period.
+	261018		Moved here from subtract_sum, and the selections are now made with the SummaryTable
+	'''
+
+	return get_summary(fileroot).select(status,prog_id,mjd_start,mjd_stop,proc_start,proc_stop)
+
+
+def steer(argv):
+	'''
+	Parse the command line and print the selected records
+
+	History:
+
+	261018	Coded
+	'''
+
+	fileroot='observations'
+	status='All'
+	prog_id=0
+
+	i=1
+	while i<len(argv):
+		if argv[i]=='-h':
+			print __doc__
+			return
+		elif argv[i]=='-status':
+			i=i+1
+			status=argv[i]
+		elif argv[i]=='-prog_id':
+			i=i+1
+			prog_id=int(argv[i])
+		elif argv[i][0]=='-':
+			print 'Could not understand argument %d :%s' % (i,argv[i])
+			return
+		else:
+			fileroot=argv[i]
+		i=i+1
+
+	for record in read_sum_file(fileroot,status,prog_id):
+		print ' '.join(record)
+	return
+
+
+# Next lines permit one to run the routine from the command line
+if __name__ == "__main__":
+	import sys
+	steer(sys.argv)
@@ -17,13 +17,16 @@ It is intended to produce a set of html files that can be viewed by the communit
 
 Command line usage (if any):
 
-	usage: prog_id.py [fileroot] 
+	usage: prog_id.py [-incremental] [fileroot] 
 
 		where fileroot is the rootname of the file that is needed by 
 		run_persist.py, normally observations.ls
 
 	 	If fileroot is omitted 'observations' is assumed
 
+		With -incremental, only the pages for programs whose records
+		have changed since the last run are made again
+
 Description:  
 
 	The routine obtains all its information the observations.ls file and 
@@ -48,6 +51,8 @@ History:
 
 110722 ksl Coding begun
 110811  ksl     Switched to standardized way to set file permissions
+261018		Use per_sum to select the records for each program from the summary file
+261018		Group the records by program in a single pass, and added -incremental
 
 '''
 
@@ -57,7 +62,9 @@ import date
 import os
 import per_list
 import subtract_sum
+import per_sum
 import permissions
+import hashlib
 
 def prog_html(sum,records,filename):
 	'''
@@ -133,19 +140,97 @@ def prog_html(sum,records,filename):
 
 	
 
-def doit(fileroot='observations'):
+def read_state(filename):
+	'''
+	Read the file written by write_state, and return a dictionary
+	containing the checksum of the records for each program id, when
+	the pages were last made.  If the file does not exist, the dictionary
+	is empty.
+
+	History:
+
+	261018	Coded
+	'''
+
+	state={}
+	try:
+		f=open(filename,'r')
+	except IOError:
+		return state
+
+	for line in f:
+		words=line.split()
+		if len(words)==2:
+			state[words[0]]=words[1]
+	f.close()
+	return state
+
+def write_state(filename,state):
+	'''
+	Write the checksum of the records for each program id, so that
+	the next time doit is run with incremental set to 'yes', only the 
+	pages whose records have changed are made again
+
+	History:
+
+	261018	Coded
+	'''
+
+	tmpfile='%s.%d.tmp' % (filename,os.getpid())
+	g=open(tmpfile,'w')
+	for prog in sorted(state):
+		g.write('%s %s\n' % (prog,state[prog]))
+	g.close()
+	os.rename(tmpfile,filename)
+	return
+
+def checksum(sum,records):
+	'''
+	Return a checksum of the summary file records and .ls records for
+	a program, which is used to decide whether the page for the program
+	needs to be made again
+
+	History:
+
+	261018	Coded
+	'''
+
+	x=hashlib.md5()
+	for one in sum:
+		x.update(' '.join(one))
+		x.update('\n')
+	x.update('#\n')
+	for one in records:
+		x.update(' '.join(one))
+		x.update('\n')
+	return x.hexdigest()
+
+def doit(fileroot='observations',incremental='no'):
 	'''
 	Do something useful
+
+	If incremental is 'yes', the pages are only made for programs whose
+	records in the .ls and .sum files have changed since the last time 
+	the pages were made, or whose pages do not exist.  The checksums 
+	of the records for each program are kept in the file Summary/prog_id.state
+
+	261018	Read the .ls and summary files once, rather than once for each program,
+		and write the page for each program once
+	261018	Added incremental
 	'''
 	records=per_list.read_ordered_list0(fileroot)
 
 	Dir='./Summary'
 
+	# Find the records for each program in a single pass
 	progs=[]
+	prog_records={}
 	for record in records:
-		progs.append(record[2])
+		if record[2] not in prog_records:
+			progs.append(record[2])
+			prog_records[record[2]]=[]
+		prog_records[record[2]].append(record)
 	
-	progs=set(progs)
 	progs=sorted(progs)
 
 
@@ -157,20 +242,45 @@ def doit(fileroot='observations'):
 		except OSError:
 			print '!NOK Could not create %s' % (Dir)
 
+	state_file=Dir+'/prog_id.state'
+	old_state={}
+	if incremental=='yes':
+		old_state=read_state(state_file)
+
+	# Read the summary file once, and find the records for each program
+	summary=per_sum.get_summary(fileroot)
+	groups=summary.group_by_prog()
+
 	# Create each of the individual html files
 
 	pi=[]
+	state={}
+	nskip=0
 	for prog in progs:
 		print prog
-		sum=subtract_sum.read_sum_file(fileroot,'All',prog)
-		records=per_list.read_ordered_list_progid(fileroot,prog)
+		sum=summary.get_records(groups.get(int(prog),[]))
+		records=prog_records[prog]
 		pi.append(records[0][16])
 
+		filename=Dir+'/prog_%s.html'% prog
+		state[prog]=checksum(sum,records)
+		if old_state.get(prog)==state[prog] and os.path.exists(filename):
+			nskip=nskip+1
+			continue
+
 		for one in sum:
 			print one
+		if len(sum)>0:
 			# subtract_sum.make_html(sum,Dir+'/prog_%s.html'% prog)
-			prog_html(sum,records,Dir+'/prog_%s.html'% prog)
+			prog_html(sum,records,filename)
 		
+	if incremental=='yes':
+		print 'The pages for %d of %d programs were unchanged' % (nskip,len(progs))
+
+	try:
+		write_state(state_file,state)
+	except (IOError,OSError):
+		print '!NOK Could not write %s' % (state_file)
 
 	# Now create the master summary file
 
@@ -203,8 +313,12 @@ def doit(fileroot='observations'):
 # Next lines permit one to run the routine from the command line
 if __name__ == "__main__":
 	import sys
-	if len(sys.argv)>1:
-		# doit(int(sys.argv[1]))
-		doit(sys.argv[1])
-	else:
-		doit('observations')
+	incremental='no'
+	fileroot='observations'
+	for arg in sys.argv[1:]:
+		if arg=='-incremental':
+			incremental='yes'
+		else:
+			# doit(int(sys.argv[1]))
+			fileroot=arg
+	doit(fileroot,incremental)
@@ -66,8 +66,32 @@ run_persist.py dateset
 
 -lookback Changes the time for looking back to earlier observations in calculating the persistnce.
 
+-cache size
+	The size in MB of the cache which holds stimulus images from one dataset to the
+	next (default 1000).  0 turns the cache off.
+
+-incremental
+	For -all and -prog_id runs, save the parts of the persistence model for each
+	stimulus image that do not depend on time from one dataset to the next, so only 
+	images that are new to the lookback window need to be fully evaluated.  The
+	outputs are identical to those of a normal run.
+
+-background
+	Write the output fits files of each dataset in a separate thread while
+	the figures for the dataset are made
+
+-compact
+	Write the persist, extper, stim and dt files in a compact form, which contains
+	only the SCI and DQ extensions, tile compressed, and refers to the flt file for
+	the rest.  The persistence images are accurate to 0.0005 e/s and the stimulus
+	image to 0.5 electrons.  See subtract_persist.set_compact
+
 -np number
-	Indicates the a given 'number' of processes will be executed simultanously
+	Indicates the a given 'number' of processes will be executed simultanously.
+	The processes are started once, and each handles many datasets.  With -all
+	and -prog_id, each process is given a contiguous stretch of time to work on, 
+	balanced by the number of stimulus images to be evaluated, so images can be
+	reused from one dataset to the next
 
 Other switches allow you to control the persistence function that is subtracted, e. g.
 
@@ -259,15 +283,128 @@ def do_dataset(dataset='ia21h2e9q',model_type=1,norm=0.3,alpha=0.2,gamma=0.8,e_f
 	log('# Finished dataset %s at %s\n' % (dataset,cur_time))
 	return
 
-def get_no_jobs(jobs):
+# These are the variables and routines used to run datasets in a pool of worker processes
+
+pool_done=0
+pool_total=0
+pool_start=0
+
+def init_worker(bundle):
+	'''
+	Initialize one of the worker processes in the pool.  The workers
+	are long-lived, so the calibration bundle and the stimulus image 
+	cache in subtract_persist are kept from one dataset to the next.
+
+	History:
+
+	261018	Coded
+	'''
+
+	subtract_persist.set_calibration(bundle)
+	return
+
+def job_done(result):
 	'''
-	Check how many jobs are running
+	Report that a set of datasets, as returned by do_chunk, has been 
+	completed.  This is called in the main process as each worker 
+	finishes a chunk.
+
+	History:
+
+	261018	Coded
+	261018	Modified to report chunks of datasets
 	'''
-	njobs=0
-	for one in jobs:
-		if one.is_alive():
-			njobs=njobs+1
-	return njobs
+	global pool_done
+
+	pool_done=pool_done+len(result)
+	print '# Completed %d datasets of %d. Elapsed time is %0.1f s' % (pool_done,pool_total,time.time()-pool_start)
+	return
+
+def do_chunk(chunk,model_type=1,norm=0.3,alpha=0.2,gamma=0.8,e_fermi=80000,kT=20000,fileroot='observations',ds9='yes',local='no',pffile='persist.pf',lookback_time=16):
+	'''
+	Process a list of datasets in order.  This is the task which 
+	is given to each worker in the pool.
+
+	A failure in one dataset is logged, and the worker goes on to the next.
+
+	History:
+
+	261018	Coded
+	'''
+
+	for one in chunk:
+		try:
+			do_dataset(one,model_type,norm,alpha,gamma,e_fermi,kT,fileroot,ds9,local,pffile,lookback_time)
+		except Exception, error:
+			log('NOK: Processing failed for dataset %s: %s\n' % (one,error))
+	return chunk
+
+def partition(records,all_records,lookback_time=16,nparts=1):
+	'''
+	Split a time-ordered list of records, for the datasets that are
+	to be processed, into nparts contiguous chunks, one for each worker.
+
+	where	records are the records from the .ls file for the datasets
+		all_records are all of the records in the .ls file, which
+			are the possible stimulus images
+		lookback_time is the time in hours subtract_persist looks back
+			for stimulus images
+
+	The chunks are balanced by the number of stimulus images that have to
+	be evaluated, that is the number of images within the lookback time
+	before each dataset, rather than by the number of datasets.
+
+	A list containing a list of dataset names for each chunk is returned.
+
+	Notes:
+
+	Each worker processes its chunk in time order, so that stimulus images 
+	are reused from one dataset to the next.  Consecutive chunks overlap by 
+	the lookback time, in the sense that the images in the lookback window of 
+	the first dataset of a chunk are also read by the worker for the previous 
+	chunk. The datasets themselves are not repeated.
+
+	History:
+
+	261018	Coded
+	'''
+
+	times=[]
+	for record in all_records:
+		times.append(float(record[6]))
+	times=numpy.sort(times)
+
+	weights=[]
+	for record in records:
+		t=float(record[6])
+		nstim=numpy.searchsorted(times,t)-numpy.searchsorted(times,t-lookback_time/24.)
+		weights.append(max(nstim,1))
+
+	nparts=max(1,min(nparts,len(records)))
+	cumulative=numpy.cumsum(weights)
+	total=cumulative[-1] if len(records)>0 else 0
+
+	chunks=[]
+	ifirst=0
+	k=1
+	while k<nparts:
+		# The chunk ends after the first dataset that takes it over the target
+		ilast=numpy.searchsorted(cumulative,total*k/float(nparts))+1
+		ilast=max(ilast,ifirst+1)
+		ilast=min(ilast,len(records)-(nparts-k))  # Leave at least one dataset for each of the remaining chunks
+		chunks.append(records[ifirst:ilast])
+		ifirst=ilast
+		k=k+1
+	chunks.append(records[ifirst:])
+
+	xchunks=[]
+	for chunk in chunks:
+		names=[]
+		for record in chunk:
+			names.append(record[1])
+		xchunks.append(names)
+
+	return xchunks
 
 
 def steer(argv):
@@ -281,7 +418,16 @@ def steer(argv):
 	111114	ksl	Added a command.log to keep track of all of the run_persist commands
 	140924	ksl	Updated to allow for varioua model types
 	160103	ksl	Begin implemenation of multiprocessing
+	261018	When multiprocessing, the calibration files are read once and shared
+		with all of the processes
+	261018	Replaced the separate process for each dataset with a pool of
+		long-lived workers
+	261018	For -all and -prog_id, the workers are given contiguous chunks of the 
+		time-ordered datasets
 	'''
+	global pool_done
+	global pool_total
+	global pool_start
 
 
 	log('# Start run_persist  %s\n' % date.get_gmt())
@@ -384,6 +530,15 @@ def steer(argv):
 		elif argv[i]=='-lookback':
 			i=i+1
 			lookback_time=eval(argv[i])
+		elif argv[i]=='-cache':
+			i=i+1
+			subtract_persist.set_stimulus_cache(eval(argv[i]))
+		elif argv[i]=='-incremental':
+			subtract_persist.set_incremental('yes')
+		elif argv[i]=='-background':
+			subtract_persist.set_background_write('yes')
+		elif argv[i]=='-compact':
+			subtract_persist.set_compact('yes')
 		elif argv[i]=='-np':
 			i=i+1
 			np=int(argv[i])
@@ -467,30 +622,39 @@ def steer(argv):
 			n=n+1
 	else:
 		print 'There will be %d processes running simultaneously' % np
+
+		# Read the calibration files once, and share them with all of the processes
+		subtract_persist.set_calibration(subtract_persist.CalibrationBundle(pffile).share())
+
+		pool_done=0
+		pool_total=ntot
+		pool_start=time.time()
+
+		pool=multiprocessing.Pool(np,init_worker,(subtract_persist.calibration,))
+		# If the datasets are in time order, give each worker a contiguous chunk of them
+		if switch=='all' or switch=='prog_id':
+			chunks=partition(records,per_list.read_ordered_list0(fileroot),lookback_time,np)
+		else:
+			chunks=[]
+			for one in datasets:
+				chunks.append([one])
+
 		jobs=[]
-		for one in datasets:
-			p=multiprocessing.Process(target=do_dataset,args=(one,model_type,norm,alpha,gamma,e_fermi,kT,fileroot,ds9,local,pffile,lookback_time,))
-			jobs.append(p)
-		i=0
-		while i<np and i<len(jobs):
-			print '!Starting %s' % datasets[i]
-			one=jobs[i]
-			one.start()
-			i=i+1
+		for chunk in chunks:
+			jobs.append(pool.apply_async(do_chunk,(chunk,model_type,norm,alpha,gamma,e_fermi,kT,fileroot,ds9,local,pffile,lookback_time),callback=job_done))
 
-		njobs=get_no_jobs(jobs)
+		# Wait for all of the workers to finish before the summary file is fixed up
+		pool.close()
+		pool.join()
 
+		i=0
 		while i<len(jobs):
-			time.sleep(2)
-			njobs=get_no_jobs(jobs)
-			print 'Running %d jobs,including job %d (%s) of %d total' % (njobs,i,datasets[i-1],len(datasets))
-			if njobs<np:
-				print 'Starting: ',datasets[i]
-				one=jobs[i]
-				one.start()
-				i=i+1
-
-		p.join()
+			if jobs[i].successful()==False:
+				try:
+					jobs[i].get()
+				except Exception, error:
+					log('NOK: Processing failed for datasets %s: %s\n' % (chunks[i],error))
+			i=i+1
 		print 'Completed multiprocessing'
 
 
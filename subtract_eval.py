@@ -90,6 +90,8 @@ def do_dataset(dataset='ib6v19bzq',radius=50,local='no'):
 		would be easier to keep track of the files that had
 		been created.  Also removed some text from figure.
 	110203	ksl	Added local switch so testing would be easier
+	261018		Read only the stamps around the peaks from the images
+	261018		Locate the SCI extensions by name, so compact files can be read
 	'''
 
 	# Read information about this dataset from the observations.ls file
@@ -151,11 +153,18 @@ def do_dataset(dataset='ib6v19bzq',radius=50,local='no'):
 
 	xy=read_peaks(file_xy)
 
-	# Read all of the images
-	flt=per_fits.get_image_ext(file_flt,1)
-	per=per_fits.get_image_ext(file_persist,1)
-	cor=per_fits.get_image_ext(file_cor,1)
-	stim=per_fits.get_image_ext(file_stim,1)
+	# Map all of the images.  Only the stamps around the peaks are actually read
+	# The outputs of subtract_persist may be compact, so the SCI extensions are located by name
+	exts=[]
+	for one in [file_persist,file_cor,file_stim]:
+		exts.append(per_fits.get_ext_number(one,'SCI'))
+	if min(exts)<0:
+		return 'Error: subtract_eval.do_dataset: Some files have no SCI extension'
+
+	flt=per_fits.map_image(file_flt,1)
+	per=per_fits.map_image(file_persist,exts[0])
+	cor=per_fits.map_image(file_cor,exts[1])
+	stim=per_fits.map_image(file_stim,exts[2])
 
 
 	all_orig=[] # This is a place to store histograms of the original data
@@ -59,6 +59,21 @@ subtract_persist.py -local - causes the output files to be written in a subdirec
 subtract_persist.py -lookback 24 - Changes the time in hours to look back in earlier datsets 
 	and calculated the persistence
 
+subtract_persist.py -cache 1000 - Sets the size in MB of the cache which holds stimulus images
+	between datasets.  0 turns the cache off.
+
+subtract_persist.py -all -incremental - Saves the parts of the persistence model for each stimulus
+	image that do not depend on time, so that in a time-ordered run only the images that 
+	are new to the lookback window need to be fully evaluated.  The results are the same.
+
+subtract_persist.py -background - Writes the output fits files for each dataset in a separate 
+	thread while the figures are being made
+
+subtract_persist.py -compact - Writes the persist, extper, stim and dt files with only the
+	SCI and DQ extensions, tile compressed, and a reference (SRCFLT) to the flt file for the 
+	others.  The persistence images are accurate to 0.0005 e/s, the stimulus image to 0.5 
+	electrons, and the rest is lossless.  The flt_cor file is always complete.
+
 Other switches allow you to control the persistence function that is subtracted, e. g.
 
 -model  -- 0 for the original fermi-function based formalism
@@ -96,6 +111,15 @@ Calibration files:
 			levels
 		fermi is the exposure-time dependent feemi
 
+	An optional line
+
+	interpolation table
+
+	uses lookup tables that are uniform in the log of the stimulus to interpolate 
+	the a_gamma and fermi models onto each stimulus image. This is faster than
+	the default, 'exact', which matches the original interpolation, and agrees 
+	with it to about 1e-4 of the peak persistence (see evaluate_table).
+
 
 Outputs:
 
@@ -146,11 +170,12 @@ import astropy.io.fits
 from ds9 import *
 from date import *
 
-from scipy.interpolate import interp1d
-
 import config
 VERSION=config.version
 
+import collections
+import multiprocessing
+
 
 
 # This is the section where the new a gamma model is calculated 
@@ -161,6 +186,15 @@ model_a=[]
 model_g=[]
 model_file=''
 
+# These are the global variables for the lookup table version of the interpolation.
+# The table is uniformly sampled in the log of the stimulus.  
+interpolation='exact'
+lut_size=4096
+lut_stim=[]
+lut_offset=0.
+lut_lo=0.
+lut_dl=0.
+
 
 def read_file(filename,char=''):
 	'''
@@ -211,11 +245,18 @@ def read_models(filename='per_fermi/fermi.fits'):
 	The interpolated Fermi models are also read in 
 	via this procedure.
 
+	If the models are part of the current calibration
+	bundle, they are taken from there rather than
+	being read again.
+
 
 	History
 
 	140803	ksl	Coded
 	140805	ksl	Replaced older read_models routine
+	261018	The stimulus grid is sorted, and the grid for the lookup tables
+		is created when the models are read
+	261018	The reading is now done by load_models
 	'''
 
 	global model_exp
@@ -231,6 +272,35 @@ def read_models(filename='per_fermi/fermi.fits'):
 	if filename==model_file and len(model_stim)>0:
 		return 'OK'
 
+	if calibration!=None and filename in calibration.models:
+		models=calibration.models[filename]
+	else:
+		models=load_models(filename)
+
+	if len(models)==0:
+		return 'NOK'
+
+	model_exp,model_stim,model_a,model_g=models
+	
+	model_file=filename
+
+	make_table_grid()
+
+	return
+
+def load_models(filename='per_fermi/fermi.fits'):
+	'''
+	Read a fits file containing models which can be expressed in
+	terms of an amplitude A and a power law decay, and return
+	[model_exp,model_stim,model_a,model_g] or an empty list
+	if the file could not be read.
+
+	History
+
+	261018	Split from read_models so the models can be kept
+		in a CalibrationBundle
+	'''
+
 	xfilename=locate_file(filename)
 
 
@@ -238,7 +308,7 @@ def read_models(filename='per_fermi/fermi.fits'):
 		x=astropy.io.fits.open(xfilename)
 	except IOError:
 		print 'read_models: file %s does not appear to exist' % filename
-		return 'NOK'
+		return []
 
 	i=1
 	model_exp=[]
@@ -258,18 +328,23 @@ def read_models(filename='per_fermi/fermi.fits'):
 		one_gamma=tabdata['gamma']
 		model_g.append(one_gamma)
 		i=i+1
+	x.close()
 	
 	model_stim=numpy.array(model_stim[0]) # Use only the first row for the stimulus
 	model_a=numpy.array(model_a)
 	model_g=numpy.array(model_g)
 
-	
-	model_file=filename
+	# The interpolation routines require the stimulus grid to be in increasing order
+	order=numpy.argsort(model_stim)
+	model_stim=model_stim[order]
+	model_a=model_a[:,order]
+	model_g=model_g[:,order]
 
-	return
+	model_exp=numpy.array(model_exp)
 
+	return [model_exp,model_stim,model_a,model_g]
 
-def read_parameter(parameter_file,parameter):
+def read_parameter(parameter_file,parameter,required='yes'):
 	'''
 	Read a single parameter, such as a calibration file name
 	from a parameter file
@@ -279,10 +354,14 @@ def read_parameter(parameter_file,parameter):
 	This simply finds the parameter file, reads it, and
 	returns the parameter as a string
 
+	If required is 'no', no error is reported if the
+	parameter is missing, and an empty string is returned
+
 	History:
 
 	141225	ksl	Coded to try to make it easier to switch calibration
 			files (which are currently hardcoded
+	261018	Added required, for parameters that are optional
 	'''
 
 	parameter_file=locate_file(parameter_file)
@@ -302,7 +381,7 @@ def read_parameter(parameter_file,parameter):
 		if len(line)>1 and line[0]==parameter:
 			value=line[1]
 			break
-	if value=='':	
+	if value=='' and required=='yes':	
 		print 'Error: Could not locate %s in %s'  % (parameter,parameter_file)
 
 	if value=='None' or value == 'none':
@@ -356,6 +435,168 @@ def locate_file(filename):
 	print 'Error: subtract_persist.locate_file: %s not in the local directory, the PerCal subdirectory, or the directory %s defined by PERCAL' % (filename,xpath)
 	return ''
 
+
+# This is the section which holds the calibration files described in the parameter file, so
+# that they are only located and read once in a run.  The current bundle is kept in calibration
+
+calibration=None
+
+class CalibrationBundle(object):
+	'''
+	The parameter file, and the calibration files it describes,
+	read once.
+
+	The parameter file is located and parsed when the bundle is
+	created.  Then the spatial correction image (xynorm) and 
+	the models (a_gamma and fermi) are read. 
+
+	parameter_file	the located parameter file, or '' if it was not found
+	mtime		the modification time of the parameter file
+	parameters	a dictionary of the keywords and values in the file
+	xynorm		the located spatial correction file, or ''
+	xcorr		the spatial correction image, or [] 
+	models		a dictionary containing the output of load_models for each
+			of the model files, indexed by the name in the parameter file
+
+	Notes:
+
+	When more than one process is used, the bundle should be created
+	and shared in the parent process before the workers are started,
+	so that each worker uses the same copy of the arrays.
+
+	History:
+
+	261018	Coded
+	'''
+
+	def __init__(self,parameter_file='persist.pf'):
+		self.parameter_file=locate_file(parameter_file)
+		self.mtime=0
+		self.parameters={}
+		self.xynorm=''
+		self.xcorr=[]
+		self.models={}
+
+		if self.parameter_file=='':
+			return
+
+		self.mtime=os.path.getmtime(self.parameter_file)
+
+		f=open(self.parameter_file)
+		lines=f.readlines()
+		f.close()
+
+		for line in lines:
+			line=line.split()
+			if len(line)>1 and line[0] not in self.parameters:
+				self.parameters[line[0]]=line[1]
+
+		xynorm=self.get('xynorm')
+		if xynorm!='':
+			self.xynorm=locate_file(xynorm)
+			self.xcorr=get_image(self.xynorm,1)
+
+		for name in ['a_gamma','fermi']:
+			xfile=self.get(name,'no')
+			if xfile!='':
+				models=load_models(xfile)
+				if len(models)>0:
+					self.models[xfile]=models
+
+	def get(self,parameter,required='yes'):
+		'''
+		Return a parameter as a string, as read_parameter does
+		'''
+
+		value=self.parameters.get(parameter,'')
+
+		if value=='' and required=='yes':	
+			print 'Error: Could not locate %s in %s'  % (parameter,self.parameter_file)
+
+		if value=='None' or value == 'none':
+			value=''
+
+		return value
+
+	def is_current(self,parameter_file):
+		'''
+		Return True if the bundle was made from parameter_file, and
+		the file has not changed since
+		'''
+
+		xfile=locate_file(parameter_file)
+		if xfile!=self.parameter_file:
+			return False
+		if xfile=='':
+			return True
+		return os.path.getmtime(xfile)==self.mtime
+
+	def share(self):
+		'''
+		Move the arrays in the bundle into shared memory, so that 
+		processes started afterwards all use a single copy.  The
+		shared arrays are read only.
+		'''
+
+		if len(self.xcorr)>0:
+			self.xcorr=share_array(self.xcorr)
+
+		for key in self.models.keys():
+			models=[]
+			for one in self.models[key]:
+				models.append(share_array(one))
+			self.models[key]=models
+
+		return self
+
+def share_array(x):
+	'''
+	Return a read-only copy of the numpy array x which 
+	is in shared memory
+
+	History:
+
+	261018	Coded
+	'''
+
+	x=numpy.ascontiguousarray(x)
+	buf=multiprocessing.RawArray('b',max(x.nbytes,1))
+	y=numpy.frombuffer(buf,dtype=x.dtype,count=x.size).reshape(x.shape)
+	y[...]=x
+	y.flags.writeable=False
+	return y
+
+def get_calibration(parameter_file='persist.pf'):
+	'''
+	Return the CalibrationBundle for parameter_file, creating it
+	if the current one is for a different file, or the file has 
+	changed
+
+	History:
+
+	261018	Coded
+	'''
+	global calibration
+
+	if calibration==None or calibration.is_current(parameter_file)==False:
+		calibration=CalibrationBundle(parameter_file)
+	return calibration
+
+def set_calibration(bundle):
+	'''
+	Make bundle the current CalibrationBundle.  This is used
+	to pass a bundle created (and shared) in a parent process 
+	to the workers
+
+	History:
+
+	261018	Coded
+	'''
+	global calibration
+
+	calibration=bundle
+	return
+
 def get_persistence(exp=300.,dt=1000.,models='per_model/models.ls'):
 	'''
 	Calculate the persistence curve using the tabulated A_gamma model
@@ -384,6 +625,7 @@ def get_persistence(exp=300.,dt=1000.,models='per_model/models.ls'):
 
 	140630	ksl	Added a variable models to allow one to read files in any directory
 			of interest
+	261018	Use searchsorted to find the exposure times which bracket exp
 
 	'''
 
@@ -392,10 +634,8 @@ def get_persistence(exp=300.,dt=1000.,models='per_model/models.ls'):
 
 	
 	# Now we need to interpolate so we have a single model given
-	# an exposure time
-	i=0
-	while i<len(model_exp) and model_exp[i]<exp:
-		i=i+1
+	# an exposure time.  i is the first model with an exposure time of at least exp
+	i=numpy.searchsorted(model_exp,exp)
 
 	# print 'get_persitence:',i,len(model_exp),model_exp[i],exp
 
@@ -426,20 +666,421 @@ def make_persistence_image(x,exptime=500,dt=300,models='a_gamma.fits'):
 
 	Note that this routine calls get_persistenee, which returns a persistence curve
 	for a particular exptime and dt. The persistence curve is on a fixed grid. Here we
-	use scipy.inter1d to produce the persisence image.
+	interpolate linearly on this curve to produce the persisence image.
+
+	History:
 
+	261018	Replaced scipy.interp1d with prepare_stimulus and evaluate_stimulus, which
+		give the same results, so that the position of each pixel on the
+		stimulus grid can be saved in the incremental mode
 	'''
 
 	persist_curve=get_persistence(exptime,dt,models)
 
 	# Now we need to interpolate this curve
-	f=interp1d(model_stim,persist_curve,fill_value=0,bounds_error=False)
+	persist=evaluate_stimulus(prepare_stimulus(x),persist_curve)
+
+	return persist
+
+def prepare_stimulus(x,mode=''):
+	'''
+	Locate each pixel of the stimulus image x on the stimulus grid of 
+	the current A gamma model.  This is the part of the interpolation
+	that does not depend on the persistence curve.
+
+	The routine returns [lo,delta] where lo is the index of grid point
+	below each pixel, or -1 if the pixel is off the grid, and delta
+	is the difference between the pixel and that grid point.
+
+	Notes:
+
+	read_models must have been called before this routine.
+
+	The calculation follows scipy.interp1d (with linear interpolation),
+	so that together with evaluate_stimulus it reproduces
+	interp1d(model_stim,curve,fill_value=0,bounds_error=False)(x)
+
+	If mode (or if mode is not given, the interpolation set by
+	set_interpolation) is 'table', the work is done by prepare_table
+	instead.
+
+	History:
+
+	261018	Coded
+	'''
 
-	persist=f(x)
+	if mode=='':
+		mode=interpolation
+	if mode=='table':
+		return prepare_table(x)
+
+	i=numpy.searchsorted(model_stim,x)
+	i=i.clip(1,len(model_stim)-1)
+	lo=i-1
+	delta=x-model_stim[lo]
+
+	if len(model_stim)<32000:
+		lo=lo.astype(numpy.int16)  # Save memory, since these are retained in the incremental mode
+
+	lo[(x<model_stim[0])|(x>model_stim[-1])]=-1
+
+	return [lo,delta]
+
+def evaluate_stimulus(prep,curve,mode=''):
+	'''
+	Evaluate the persistence image given the output of prepare_stimulus, and
+	a persistence curve on the stimulus grid of the current model.
+
+	Pixels that lie outside of the grid have no persistence.
+
+	mode must be the same as was used in prepare_stimulus.
+
+	History:
+
+	261018	Coded
+	'''
+
+	if mode=='':
+		mode=interpolation
+	if mode=='table':
+		return evaluate_table(prep,curve)
+
+	lo,delta=prep
+
+	slope=(curve[1:]-curve[:-1])/(model_stim[1:]-model_stim[:-1])
+
+	k=lo.clip(0)
+	persist=slope[k]*delta+curve[k]
+	persist[lo<0]=0
 
 	return persist
 
 
+# This is the section which caches the stimulus images between datasets.  Consecutive
+# datasets in a time-ordered list share most of the images that preceded them, so the
+# images are kept, in electrons and mapped onto the science image, until the cache
+# exceeds stim_cache_max bytes, at which point the least recently used are dropped.
+
+stim_cache=collections.OrderedDict()
+stim_cache_bytes=0
+stim_cache_max=1000*1024*1024
+stim_cache_hits=0
+stim_cache_reads=0
+
+def set_stimulus_cache(mbytes=1000):
+	'''
+	Set the maximum size of the stimulus cache in MB.  A size of 0 
+	turns the cache off.  If the cache is larger than the new maximum
+	the least recently used images are removed.
+
+	History:
+
+	261018	Coded
+	'''
+	global stim_cache_max
+
+	stim_cache_max=int(mbytes*1024*1024)
+	trim_stimulus_cache()
+	return
+
+def trim_stimulus_cache():
+	'''
+	Remove the least recently used images from the stimulus cache until
+	it is no larger than stim_cache_max
+	'''
+	global stim_cache_bytes
+
+	while len(stim_cache)>0 and stim_cache_bytes>stim_cache_max:
+		key,value=stim_cache.popitem(last=False)
+		stim_cache_bytes=stim_cache_bytes-value[2]
+	return
+
+def get_stimulus(filename,fileref,geometry,fix='no'):
+	'''
+	Get a stimulus image in electrons and its dq array, both mapped 
+	onto the pixels of fileref, the science image.
+
+	where
+		filename	the image that may cause persistence
+		fileref		the science image
+		geometry	the output of get_image_pixel_info for fileref, which
+				is used along with the name and modification time of
+				filename to identify an image in the cache
+		fix		if 'yes' the stimulus has been corrected with fixup for
+				saturated pixels with low values.  
+
+	The routine returns x,dq.  If there is no dq extension, dq is an empty
+	list, and if the stimulus image cannot be read x is an empty list.
+
+	Notes:
+
+	The arrays that are returned are shared with the cache and so are
+	marked as read only.   
+
+	History:
+
+	261018	Coded so that consecutive datasets do not have to reread the
+		same stimulus images
+	261018	Read the image and the dq with read_exposure
+	'''
+
+	global stim_cache_bytes
+	global stim_cache_hits
+	global stim_cache_reads
+
+	try:
+		key=(filename,os.path.getmtime(filename),'e',fix,tuple(geometry))
+	except OSError:
+		key=''
+
+	if key!='' and key in stim_cache:
+		value=stim_cache.pop(key)
+		stim_cache[key]=value  # This makes it the most recently used
+		stim_cache_hits=stim_cache_hits+1
+		return value[0],value[1]
+
+	stim_cache_reads=stim_cache_reads+1
+
+	# Read the image, converted to electrons, and the dq together
+	exposure=read_exposure(filename,'e',fileref=fileref)
+	if exposure==None:
+		return [],[]
+	x=exposure.sci
+	dq=exposure.dq
+
+	if fix=='yes' and len(dq)>0:
+		x=fixup(x,numpy.bitwise_and(dq,256))
+
+	x.flags.writeable=False
+	nbytes=x.nbytes
+	if len(dq)>0:
+		dq.flags.writeable=False
+		nbytes=nbytes+dq.nbytes
+
+	if key!='' and nbytes<=stim_cache_max:
+		stim_cache[key]=[x,dq,nbytes]
+		stim_cache_bytes=stim_cache_bytes+nbytes
+		trim_stimulus_cache()
+
+	return x,dq
+
+
+# This is the section for the lookup table version of the interpolation on the stimulus grid.
+# It is selected by the line 
+#
+# interpolation table
+#
+# in the parameter file. The default is 'exact', which reproduces scipy.interp1d.  
+
+def set_interpolation(mode='exact'):
+	'''
+	Choose how the persistence curve for the A gamma models is interpolated 
+	onto the stimulus image.  mode is either 'exact' or 'table'.  Anything
+	else, including an empty string, is taken as 'exact'.
+
+	History:
+
+	261018	Coded
+	'''
+	global interpolation
+	global envelope
+
+	if mode!='table':
+		mode='exact'
+
+	if mode!=interpolation:
+		interpolation=mode
+		envelope={}  # Saved information from prepare_stimulus is specific to one mode
+	return interpolation
+
+def make_table_grid():
+	'''
+	Set up the grid of stimulus values for the lookup tables.  This is 
+	lut_size points uniformly spaced in log10 of the stimulus plus an
+	offset, from the first point of the model grid to the last one.  The
+	offset is 0 unless the model grid starts at or below zero, in which
+	case it is chosen so the grid starts at 1 e. 
+
+	The grid is set up by read_models, and depends only on the 
+	stimulus grid of the models.
+
+	History:
+
+	261018	Coded
+	'''
+	global lut_stim
+	global lut_offset
+	global lut_lo
+	global lut_dl
+
+	lut_offset=0.
+	if model_stim[0]<=0:
+		lut_offset=1.-model_stim[0]
+
+	lut_lo=math.log10(model_stim[0]+lut_offset)
+	lut_dl=(math.log10(model_stim[-1]+lut_offset)-lut_lo)/(lut_size-1)
+	lut_stim=10.**(lut_lo+lut_dl*numpy.arange(lut_size))-lut_offset
+	lut_stim[0]=model_stim[0]
+	lut_stim[-1]=model_stim[-1]
+
+	return
+
+def prepare_table(x):
+	'''
+	The lookup table version of prepare_stimulus.  The index of the table 
+	point below each pixel is found directly from the log of the stimulus,
+	rather than by a binary search.
+
+	The routine returns [j,frac] where j is the index into the table
+	and frac is the fractional distance, in the log, to the next point.
+	Pixels that are off the model grid are given the index lut_size-1, 
+	which evaluate_table sets to zero.
+
+	History:
+
+	261018	Coded
+	'''
+
+	if len(lut_stim)==0:
+		make_table_grid()
+
+	z=numpy.clip(x,lut_stim[0],lut_stim[-1])+lut_offset
+	u=numpy.log10(z)
+	u-=lut_lo
+	u*=1./lut_dl
+	u=u.clip(0,lut_size-1)  # Guard against rounding at the ends of the table
+	j=u.astype(numpy.int16)
+	j=numpy.minimum(j,lut_size-2,j)
+	frac=u-j
+	frac=frac.astype(numpy.float32)
+
+	j[(x<lut_stim[0])|(x>lut_stim[-1])]=lut_size-1
+
+	return [j,frac]
+
+def evaluate_table(prep,curve):
+	'''
+	The lookup table version of evaluate_stimulus.  The persistence
+	curve is first sampled onto the table, and then interpolated 
+	linearly at each pixel.
+
+	Notes:
+
+	The persistence curve is linear between points on the model grid,
+	and the table is fine enough that the only significant differences
+	from the exact calculation arise in the intervals of the table which 
+	contain a point of the model grid. With the default of 4096 points 
+	in the table, and a model grid with 80 points from 1e2 to 1e6 e, the 
+	largest difference in tests against the exact calculation was 1e-4 of
+	the peak of the persistence curve, and the rms difference was 
+	about 1e-6 of the peak.
+
+	History:
+
+	261018	Coded
+	'''
+
+	j,frac=prep
+
+	table=numpy.interp(lut_stim,model_stim,curve)
+	slope=numpy.zeros(lut_size)
+	slope[:-1]=table[1:]-table[:-1]
+
+	# The last entry is for pixels off the grid
+	table[-1]=0.
+	slope[-1]=0.
+
+	persist=numpy.take(slope,j)
+	persist*=frac
+	persist+=numpy.take(table,j)
+
+	return persist
+
+
+# This is the section for the incremental mode.  In a time-ordered run, each stimulus image is
+# used for all of the datasets within the lookback time that follow it.   The part of its persistence
+# model which does not depend on the time since the stimulus, the fermi function for model 0 or 
+# the position of each pixel on the stimulus grid for the other models, is saved in envelope,
+# so that only images that are new to the lookback window need a full calculation.  
+#
+# Note that it is not possible just to update the persistence image from the last dataset because
+# the model that produces the most persistence in a pixel can change as the time since the stimuli
+# increases.  
+
+envelope={}
+envelope_mode='no'
+
+def set_incremental(mode='yes'):
+	'''
+	Turn the incremental mode on ('yes') or off ('no').  Turning
+	it off discards any saved information.
+
+	History:
+
+	261018	Coded
+	'''
+	global envelope_mode
+	global envelope
+
+	envelope_mode=mode
+	if mode!='yes':
+		envelope={}
+	return
+
+def get_envelope(filename,geometry,x,model_type,models,alpha=0.2,e_fermi=80000,kT=20000):
+	'''
+	Return the part of the persistence model for the stimulus image x (read from filename)
+	that does not depend on the time since the stimulus, calculating it if it has not been
+	saved already.  geometry is that of the science image, which x has been
+	trimmed to match.
+
+	For model_type 0, this is the fermi function; otherwise it is the output of
+	prepare_stimulus for the models in the file models.
+
+	History:
+
+	261018	Coded
+	'''
+
+	if model_type==0:
+		key=(filename,tuple(geometry),model_type,alpha,e_fermi,kT)
+	else:
+		key=(filename,tuple(geometry),model_type,models,interpolation)
+
+	try:
+		key=key+(os.path.getmtime(filename),)
+	except OSError:
+		pass
+
+	if key in envelope:
+		return envelope[key]
+
+	if model_type==0:
+		value=calc_fermi(x,1.,e_fermi,kT,alpha)
+	else:
+		read_models(models)
+		value=prepare_stimulus(x)
+
+	envelope[key]=value
+	return value
+
+def trim_envelope(filenames):
+	'''
+	Remove the saved information for any stimulus images that are not in the list
+	filenames, normally because they are no longer within the lookback time.
+
+	History:
+
+	261018	Coded
+	'''
+
+	filenames=set(filenames)
+	for key in envelope.keys():
+		if key[0] not in filenames:
+			del envelope[key]
+	return
+
+
 # These are the routines used to calculate the original fermi formula based model
 
 def calc_fermi(x,norm=1.0,e_fermi=80000,kt=20000,alpha=0.2):
@@ -646,6 +1287,82 @@ def get_stats(image,saturation=70000):
 	return values
 
 
+# The number of stimulus images that are combined at one time by stack_persistence
+NSTACK=8
+
+def stack_persistence(models,stimuli,dts,persist=[],stimulus=[],xtimes=[]):
+	'''
+	Combine a set of persistence models into a single persistence image
+	by finding for each pixel the model that produces the most persistence.
+
+	where
+
+	models		a list of persistence images, one for each stimulus image,
+			in the order the stimulus images were taken
+	stimuli		a list of the corresponding stimulus images
+	dts		a list of the times between each stimulus image and
+			the science image
+	persist, stimulus, xtimes
+			optionally, the results of an earlier call to this
+			routine, which are treated as if they were the first
+			image in the stack
+
+	The routine returns persist,stimulus,xtimes, that is the maximum
+	persistence, the stimulus that caused it and the time since the
+	stimulus for each pixel.
+
+	Notes:
+
+	This produces the same results as comparing the models one at
+	a time, that is where two models give the same persistence
+	the earlier one is retained, as is a NaN in the first image.
+	Memory is limited by having the calling routine pass the images
+	in groups (of NSTACK) and carrying the results forward.
+
+	History:
+
+	261018	Coded to replace the three numpy.select calls per stimulus
+		image in do_dataset with a single reduction over the stack
+	'''
+
+	dts=list(dts)
+	first_type=numpy.asarray(models[0]).dtype
+	if len(persist)>0:
+		models=[persist]+list(models)
+		stimuli=[stimulus]+list(stimuli)
+		dts=[0.0]+dts
+
+	# 3-d blocks with the stimulus images as the first axis
+	models=numpy.array(models)
+	stimuli=numpy.array(stimuli)
+
+	# Mimic the comparison model>persist, which is false for NaNs
+	bad=numpy.isnan(models)
+	if bad.any():
+		key=numpy.where(bad,-numpy.inf,models)
+		key[0][bad[0]]=numpy.inf
+	else:
+		key=models
+
+	# argmax returns the first of equal values, so earlier images win ties
+	imax=numpy.argmax(key,axis=0)
+	iy,ix=numpy.ogrid[0:imax.shape[0],0:imax.shape[1]]
+
+	xpersist=models[imax,iy,ix]
+	xstimulus=stimuli[imax,iy,ix]
+
+	if len(persist)>0:
+		zz=numpy.array(dts)
+		xxtimes=numpy.where(imax>0,zz[imax],xtimes).astype(xtimes.dtype)
+	else:
+		# The times have the same type as the first persistence image
+		zz=numpy.array(dts,dtype=first_type)
+		xxtimes=zz[imax]
+
+	return xpersist,xstimulus,xxtimes
+
+
+
 
 
 
@@ -653,6 +1370,51 @@ def get_stats(image,saturation=70000):
 
 
 
+# This determines whether the output fits files are written in a separate thread, 
+# while the figures are made
+
+background_write='no'
+
+def set_background_write(mode='yes'):
+	'''
+	Write the output fits files for each dataset in the background ('yes')
+	or not ('no')
+
+	History:
+
+	261018	Coded
+	'''
+	global background_write
+
+	background_write=mode
+	return
+
+
+# This determines whether the persistence, external persistence, stimulus and time
+# files are written in the compact form of ProductWriter.  The persistence images
+# (in e/s) and the stimulus image (in electrons) are quantized with the steps in 
+# compact_steps, so that no pixel changes by more than half of the step, that
+# is 0.0005 e/s and 0.5 electrons.  The time image and the DQ extensions
+# are compressed losslessly.
+
+compact='no'
+compact_steps={'persist':0.001,'stim':1.0}
+
+def set_compact(mode='yes'):
+	'''
+	Write the persistence, external persistence, stimulus and time files for
+	each dataset in the compact form ('yes') or as full copies of the flt 
+	file ('no')
+
+	History:
+
+	261018	Coded
+	'''
+	global compact
+
+	compact=mode
+	return
+
 
 def do_dataset(dataset='ia21h2e9q',model_type=0,norm=0.3,alpha=0.2,gamma=0.8,e_fermi=80000,kT=20000,fileroot='observations',ds9='yes',local='no',parameter_file='persist.pf',lookback_time=16):
 	'''
@@ -700,15 +1462,49 @@ def do_dataset(dataset='ia21h2e9q',model_type=0,norm=0.3,alpha=0.2,gamma=0.8,e_f
 	140611	ksl	Began to add in new persistnce model, initially just by short-circuiting everything
 	140803	ksl	Switched to fits version of data files
 	141124	ksl	Small change to handle situations were the flat field correction is not found
+	261018	Models from the stimulus images are now combined in stacks by stack_persistence
+		instead of one at a time
+	261018	Stimulus images are now read through get_stimulus, which caches them between datasets
+	261018	Added the incremental mode, see get_envelope
+	261018	The interpolation on the stimulus grid can be chosen in the parameter file
+	261018	The calibration files are taken from a CalibrationBundle, and are only read
+		once in a run
+	261018	The fits files are read in a FitsSession (see per_fits), so each is only opened 
+		once.  The work is now done by process_dataset.
+	'''
+
+	begin_session()
+	try:
+		return process_dataset(dataset,model_type,norm,alpha,gamma,e_fermi,kT,fileroot,ds9,local,parameter_file,lookback_time)
+	finally:
+		end_session()
+
+def process_dataset(dataset='ia21h2e9q',model_type=0,norm=0.3,alpha=0.2,gamma=0.8,e_fermi=80000,kT=20000,fileroot='observations',ds9='yes',local='no',parameter_file='persist.pf',lookback_time=16):
+	'''
+	Create a persistence image for this dataset, as described in do_dataset, 
+	which opens the FitsSession in which this is run.
+
+	Notes:
+
+	The stimulus images are removed from the session once they have been read,
+	since get_stimulus keeps the arrays that are needed.
+
+	The output fits files are written with a ProductWriter, in the background
+	while the figures are made if set_background_write has been called, and 
+	in the compact form if set_compact has been called.
+
+	History
+
+	261018	Split from do_dataset
+	261018	Write the output fits files with a ProductWriter
+	261018	Added the option of compact output files
 	'''
 
 	cur_time=date.get_gmt()
 
-	xfile=locate_file(parameter_file)
-	if xfile=='':
+	cal=get_calibration(parameter_file)
+	if cal.parameter_file=='':
 		print '# Error: Could not locate parameter file %s ' % parameter_file
-	else:
-		parameter_file=xfile
 
 
 	if model_type==0:
@@ -823,14 +1619,24 @@ def do_dataset(dataset='ia21h2e9q',model_type=0,norm=0.3,alpha=0.2,gamma=0.8,e_f
 	ext_values=[]  # A place to store information about the persistence due to other observers
 	ext_persist=[] # This is a place holder for storing the extenal persistence
 
-	xynorm=read_parameter(parameter_file,'xynorm')
+	mode=set_interpolation(cal.get('interpolation','no'))
+	if model_type>0:
+		history.write('! Interpolation on the stimulus grid: %s\n' % mode)
+
+	# The model file for the A gamma or fermi models
+	if model_type==1:
+		model_name=cal.get('a_gamma')
+	elif model_type==2:
+		model_name=cal.get('fermi')
+
+	xynorm=cal.get('xynorm')
 	if xynorm!='':
-		xynorm=locate_file(xynorm)
-		xcorr=get_image(xynorm,1)
+		xcorr=cal.xcorr
 		if len(xcorr)==0:
-			xynorm=''  # This is an error because we were unable to find the file
 			history.write('! Error: Could not find correction file %s containing spatial dependence. Continuing anyway' % xynorm)
+			xynorm=''  # This is an error because we were unable to find the file
 		else:
+			xynorm=cal.xynorm
 			history.write('! Reference file containing spatial dependence:  %s\n' % xynorm)
 	else:
 		string='! Processing without spatially dependent correction'
@@ -840,7 +1646,19 @@ def do_dataset(dataset='ia21h2e9q',model_type=0,norm=0.3,alpha=0.2,gamma=0.8,e_f
 
 
 
+	# The geometry of the science image is used to identify stimulus images in the cache
+	geometry=get_image_pixel_info(science_record[0],1)
+	nhits=stim_cache_hits
+	nreads=stim_cache_reads
+
 	# This is the beginning of the loop for calculating the persistence model
+	persist=[]
+	stimulus=[]
+	xtimes=[]
+	stack_models=[]
+	stack_stimuli=[]
+	stack_dts=[]
+	stim_files=[]
 	i=0
 	while i<len(records)-1:
 		record=records[i]
@@ -865,14 +1683,21 @@ def do_dataset(dataset='ia21h2e9q',model_type=0,norm=0.3,alpha=0.2,gamma=0.8,e_f
 			print 'Using ima file for ',record[0],xfile,scan
 
 
-		x=get_image(xfile,1,'e',fileref=science_record[0])  # Convert this to electrons
+		# For the fermi model, the fixup for saturated pixels is carried out when the image is read
+		if model_type==0:
+			x,dq=get_stimulus(xfile,science_record[0],geometry,'yes')
+		else:
+			x,dq=get_stimulus(xfile,science_record[0],geometry)
 		if len(x)==0:
 			xstring='NOK: Problem with science extension of %s' % record[0]
 			history.write('%s\n' % xstring)
 			print xstring
 			return xstring
 
-		dq=get_image(xfile,3,fileref=science_record[0])     # Get the dq 
+		# The stimulus image is not needed again for this dataset
+		evict(record[0])
+		evict(xfile)
+
 		if len(dq)==0:
 			xstring = 'NOK: Problem with dq extension of %s' % record[0]
 			history.write('%s\n' % xstring)
@@ -880,38 +1705,53 @@ def do_dataset(dataset='ia21h2e9q',model_type=0,norm=0.3,alpha=0.2,gamma=0.8,e_f
 			# 110926 - ksl - modified to allow this to process the image even if there was no dq array
 			# return xstring
 
+		stim_file=xfile
+		stim_files.append(stim_file)
+
 		if model_type==0:
-			model_persistence=calc_persist(x,dq,dt,norm,alpha,gamma,e_fermi,kT)
+			# x has already been fixed up using the dq array by get_stimulus
+			if envelope_mode=='yes':
+				model_persistence=get_envelope(stim_file,geometry,x,model_type,'',alpha,e_fermi,kT)*calc_decay(dt,norm,gamma)
+			else:
+				model_persistence=calc_persist(x,[],dt,norm,alpha,gamma,e_fermi,kT)
 		elif model_type==1:
 			# print 'Model type is 1'
-			xfile=read_parameter(parameter_file,'a_gamma')
-			# The next lines are awkward, becuate the parameter file name is read multiple times
+			xfile=model_name
 			if i==0:
 				history.write('! Reference file containing spatially-averaged peristence model: %s' %  xfile)
-			model_persistence=make_persistence_image(x,cur_sci_exp,dt,xfile)
+			if envelope_mode=='yes':
+				prep=get_envelope(stim_file,geometry,x,model_type,xfile)
+				model_persistence=evaluate_stimulus(prep,get_persistence(cur_sci_exp,dt,xfile))
+			else:
+				model_persistence=make_persistence_image(x,cur_sci_exp,dt,xfile)
 		elif model_type==2:
 			# print 'Model type is 2'
-			xfile=read_parameter(parameter_file,'fermi')
+			xfile=model_name
 			if i==0:
 				history.write('! Reference file containing Spatially-averaged peristence model: %s' %  xfile)
-			model_persistence=make_persistence_image(x,cur_sci_exp,dt,xfile)
+			if envelope_mode=='yes':
+				prep=get_envelope(stim_file,geometry,x,model_type,xfile)
+				model_persistence=evaluate_stimulus(prep,get_persistence(cur_sci_exp,dt,xfile))
+			else:
+				model_persistence=make_persistence_image(x,cur_sci_exp,dt,xfile)
 		else:
 			print 'Error: subtract_persist: Unknown model type %d' % model_type
 			return 'NOK'
 
 		values=how_much(model_persistence)
 
-		if i==0:
-			persist=model_persistence
-			stimulus=x   # This is an array which contains the maximum counts in a pixel
-			xtimes=numpy.ones_like(persist)
-			xtimes=xtimes*dt # This is an array containing the delta time at which the stimulus occured
-		else:
-			xpersist=model_persistence
-			stimulus=numpy.select([xpersist>persist],[x],default=stimulus)
-			xtimes=numpy.select([xpersist>persist],[dt],default=xtimes)
-			persist=numpy.select([xpersist>persist],[xpersist],default=persist)
-		
+		# Save the model, and combine the stack of models when it is full
+		# persist is the maximum persistence, stimulus the counts that caused it and
+		# xtimes the delta time at which the stimulus occurred
+		stack_models.append(model_persistence)
+		stack_stimuli.append(x)
+		stack_dts.append(dt)
+		if len(stack_models)==NSTACK or i==last_external or i==len(records)-2:
+			persist,stimulus,xtimes=stack_persistence(stack_models,stack_stimuli,stack_dts,persist,stimulus,xtimes)
+			stack_models=[]
+			stack_stimuli=[]
+			stack_dts=[]
+
 
 		# Get some elementary statistics on the stimulus
 		xvalues=get_stats(x,70000)
@@ -948,6 +1788,12 @@ def do_dataset(dataset='ia21h2e9q',model_type=0,norm=0.3,alpha=0.2,gamma=0.8,e_f
 	
 	# This is the end of the loop where the persistence model is calculated
 
+	history.write('\n! Stimulus images: %d read, %d from the cache\n' % (stim_cache_reads-nreads,stim_cache_hits-nhits))
+
+	# Forget the stimulus images which are not in the current lookback window
+	if envelope_mode=='yes':
+		trim_envelope(stim_files)
+
 	# First report on the external persistence for this file;
 
 	# Now apply the fix to account for spatial variations in persistence
@@ -1029,16 +1875,26 @@ def do_dataset(dataset='ia21h2e9q',model_type=0,norm=0.3,alpha=0.2,gamma=0.8,e_f
 	stimulus_file=path+dataset+'_stim.fits'
 	time_file=path+dataset+'_dt.fits'
 
-	rewrite_fits(xname[0],persist_file,1,persist)
-	rewrite_fits(xname[0],corrected_file,1,science)
-	rewrite_fits(xname[0],stimulus_file,1,stimulus)
+	# The science file is read once for all of the outputs
+	# The corrected flt is always written in full, but the other files may be compact
+	rice='none'
+	gzip='none'
+	if compact=='yes':
+		rice='RICE_1'
+		gzip='GZIP_1'
+
+	products=ProductWriter(xname[0])
+	products.add(persist_file,persist,compression=rice,step=compact_steps['persist'])
+	products.add(corrected_file,science)
 	# 140606 - Fix added to put stimulus file in the correct units.
-	put_keyword(stimulus_file,1,'bunit','ELECTRONS')
-	rewrite_fits(xname[0],time_file,1,xtimes)
+	products.add(stimulus_file,stimulus,{'BUNIT':'ELECTRONS'},compression=rice,step=compact_steps['stim'])
+	products.add(time_file,xtimes,compression=gzip)
 	if len(ext_persist)>0:
-		rewrite_fits(xname[0],ext_persist_file,1,ext_persist)
+		products.add(ext_persist_file,ext_persist,compression=rice,step=compact_steps['persist'])
+	products.write(background_write)
 
-	# This completes the section which writes out all of the fits files
+	# This completes the section which writes out all of the fits files, although
+	# they may still be being written in the background
 		
 	# Get statistics on the images and make the 4 panel plot 
 
@@ -1081,6 +1937,9 @@ def do_dataset(dataset='ia21h2e9q',model_type=0,norm=0.3,alpha=0.2,gamma=0.8,e_f
 	# Eliminated to prevent an error on linux having to do with tkinter
 	# pylab.close('all')
 
+	# Wait until the fits files have been written
+	products.join()
+
 	if ds9=='yes':
 		LoadFrame(science_record[0],1,0,2,'histequ')
 		LoadFrame(persist_file,2,0,2,'histequ')
@@ -1193,6 +2052,15 @@ def steer(argv):
 		elif argv[i]=='-lookback':
 			i=i+1
 			lookback=eval(argv[i])
+		elif argv[i]=='-cache':
+			i=i+1
+			set_stimulus_cache(eval(argv[i]))
+		elif argv[i]=='-incremental':
+			set_incremental('yes')
+		elif argv[i]=='-background':
+			set_background_write('yes')
+		elif argv[i]=='-compact':
+			set_compact('yes')
 		elif argv[i][0]=='-':
 			print 'Error: subtract_persist.steer: Unknown switch ---  %s' % argv[i]
 			return
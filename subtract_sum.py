@@ -41,6 +41,7 @@ History:
 110428	ksl	Rewrote using stand alone regions, not markup.py to allow for makeing a table
 111115	ksl	Began adding routines to include a figure of how bad the persistence is
 		on average
+261018		read_sum_file moved to per_sum
 
 '''
 
@@ -54,6 +55,7 @@ import sys
 import date
 import os
 import per_list
+import per_sum
 import numpy
 import html
 import pylab
@@ -138,91 +140,12 @@ def read_sum_file(fileroot='observations',status='Complete',prog_id=0,mjd_start=
 			NOTE -- It is not obvious that one should check for status at all, since one usually wants
 			to see what happened to a serios of files. What is more relevebant is the program ID or
 			whether one attempted to process it in a certain period.
+	261018		The work is now done by per_sum.read_sum_file, which only reads the file once
 
 
 	'''
 
-	filename=fileroot+'.sum'
-
-	try:
-		f=open(filename,'r')
-		xlines=f.readlines()
-		f.close()
-	except IOError :
-		print "The file %s does not exist" % filename
-		return []   
-	
-	lines=[]
-
-	# print 'OK0',len(xlines)
-	
-	i=0
-	while i<len(xlines):
-		z=xlines[i].strip()
-		z=z.split()
-		if len(z)>0:
-			if z[0][0]!='#':
-				# print z[5].count(status),z
-				if z[5].count(status) or status=='All':
-					lines.append(z)
-		i=i+1
-	
-	# print 'OK1',len(lines)
-	
-	# At this point we have split the records into words and we have chosen according to status
-
-	if prog_id != 0:
-		xlines=lines
-		lines=[]
-		for z in xlines:
-			if int(z[1])==int(prog_id):
-				lines.append(z)
-	# At this point our list has been reduced to those of the status we want and the prog_id we want
-
-	# print 'OK2',len(lines)
-
-	# 130103 - Added to fix bug where start time is provided but no end time
-	if mjd_start>0 and mjd_stop==0:
-		mjd_stop=mjd_start+1e6  # A large number
-
-	if mjd_stop > 0 and mjd_start <  mjd_stop:
-		xlines=lines
-		lines=[]
-		for z in xlines:
-			xtime=eval(z[2])
-			if mjd_start <= xtime and xtime <= mjd_stop:
-				lines.append(z)
-
-	# Convert proc start and stop time to MJD
-	# print 'OK3',len(lines)
-
-	if proc_start!=0:
-		try:
-			proc_start=float(proc_start)
-		except ValueError:
-			proc_start=date.parse_iso(proc_start)
-
-	if proc_stop!=0:
-		try:
-			proc_stop =float(proc_stop )
-		except ValueError:
-			proc_stop =date.parse_iso(proc_stop )
-
-	if proc_stop != 0 or proc_start <  proc_stop:
-		xlines=lines
-		lines=[]
-		for z in xlines:
-			# print z
-			# Construct the process time
-			proc_time='%s %s' % (z[3],z[4])
-			# print 'Starting',proc_time
-			proc_time=date.parse_iso(proc_time)  # Convert to Mjd
-			# print proc_time, 'xxx',proc_start,proc_stop
-			if proc_start <= proc_time and proc_time<=proc_stop:
-				lines.append(z)
-	# print 'OK4',len(lines)
-
-	return lines
+	return per_sum.read_sum_file(fileroot,status,prog_id,mjd_start,mjd_stop,proc_start,proc_stop)
 
 def worst(lines,records,nmax=500):
 	'''